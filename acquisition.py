@@ -0,0 +1,155 @@
+"""
+Streaming acquisition of Maestro input channels.
+
+A Maestro channel configured as an input reports its voltage through Get
+Position (0-1023 for 0-5V, digital inputs read 0 or 1023).  InputStream samples
+a set of such channels on a background thread, one pipelined
+Controller.get_positions() round trip per sample, into a NumPy ring buffer.
+Threshold triggers are evaluated on the acquisition thread right after each
+sample, so a limit switch callback runs within one sample period.  Consumers
+that only need the data (the WebSocket stream in app.py) poll read_since().
+"""
+
+import logging
+import threading
+import time
+
+import numpy as np
+
+import maestro
+
+logger = logging.getLogger('maestro')
+
+RISING = 'rising'
+FALLING = 'falling'
+BOTH = 'both'
+
+DEFAULT_RATE_HZ = 200
+DEFAULT_CAPACITY = 4096
+
+
+class Trigger(object):
+    """
+    Calls callback(chan, value, t) when the input changes state in the direction
+    given by edge.  The input becomes high once it reaches level and low again
+    once it drops below level - hysteresis, so a noisy input does not fire
+    repeatedly around the threshold.
+    """
+    def __init__(self, chan, level, callback, edge=RISING, hysteresis=0):
+        if edge not in (RISING, FALLING, BOTH):
+            raise NameError("edge must be one of rising, falling or both")
+        self.chan = chan
+        self.level = level
+        self.callback = callback
+        self.edge = edge
+        self.hysteresis = hysteresis
+        self.high = None
+
+    def update(self, value, t):
+        if self.high is None:
+            self.high = value >= self.level
+        elif not self.high and value >= self.level:
+            self.high = True
+            if self.edge in (RISING, BOTH):
+                self.callback(self.chan, value, t)
+        elif self.high and value < self.level - self.hysteresis:
+            self.high = False
+            if self.edge in (FALLING, BOTH):
+                self.callback(self.chan, value, t)
+
+
+class InputStream(object):
+    """
+    Samples the raw readings of channels at rate_hz (0 = as fast as the link
+    allows) into a ring buffer of capacity samples.
+    """
+    def __init__(self, arm, channels, rate_hz=DEFAULT_RATE_HZ, capacity=DEFAULT_CAPACITY):
+        self.arm = arm
+        self.channels = list(channels)
+        if not self.channels:
+            raise NameError("InputStream needs at least one channel")
+        self.rate_hz = rate_hz
+        self.capacity = capacity
+        self.times = np.zeros(capacity)
+        self.values = np.zeros((capacity, len(self.channels)), dtype=np.uint16)
+        self.count = 0
+        self.errors = 0
+        self.triggers = []
+        self.running = False
+        self.thread = None
+
+    def add_trigger(self, chan, level, callback, edge=RISING, hysteresis=0):
+        """ Register a threshold callback, see Trigger.  Returns the trigger """
+        if chan not in self.channels:
+            raise NameError("Channel {} is not sampled by this stream".format(chan))
+        trigger = Trigger(chan, level, callback, edge, hysteresis)
+        self.triggers.append(trigger)
+        return trigger
+
+    def remove_trigger(self, trigger):
+        self.triggers.remove(trigger)
+
+    def start(self):
+        if self.running:
+            return
+        logger.info("InputStream.start(channels=%s, rate_hz=%s)", self.channels, self.rate_hz)
+        self.running = True
+        self.thread = threading.Thread(target=self._run, name='maestro-inputs')
+        self.thread.daemon = True
+        self.thread.start()
+
+    def stop(self):
+        self.running = False
+        if self.thread is not None:
+            self.thread.join()
+            self.thread = None
+
+    def _run(self):
+        period = 1.0 / self.rate_hz if self.rate_hz > 0 else 0
+        next_time = time.time()
+        while self.running:
+            # input requests go in the high priority lane, ahead of bulk streaming
+            values = self.arm.get_positions(self.channels, raw=True, priority=maestro.PRIORITY_HIGH)
+            t = time.time()
+            if min(values) < 0:
+                self.errors += 1
+            else:
+                self.add_sample(t, values)
+            if period:
+                next_time += period
+                delay = next_time - time.time()
+                if delay > 0:
+                    time.sleep(delay)
+                else:
+                    next_time = time.time()
+
+    def add_sample(self, t, values):
+        ix = self.count % self.capacity
+        self.times[ix] = t
+        self.values[ix] = values
+        self.count += 1
+        for trigger in self.triggers:
+            value = values[self.channels.index(trigger.chan)]
+            try:
+                trigger.update(value, t)
+            except Exception as e:
+                logger.error("InputStream trigger on channel %s failed: %s", trigger.chan, e)
+
+    def latest(self):
+        """ Most recent reading of every channel as {chan: value}, empty before the first sample """
+        if self.count == 0:
+            return {}
+        row = self.values[(self.count - 1) % self.capacity]
+        return dict(zip(self.channels, row.tolist()))
+
+    def read_since(self, count):
+        """
+        Samples taken after the first `count` samples, at most capacity of them.
+        Returns (new_count, times, values); pass new_count to the next call.
+        """
+        end = self.count
+        start = max(count, end - self.capacity)
+        if start >= end:
+            return end, self.times[:0].copy(), self.values[:0].copy()
+        ix = np.arange(start, end) % self.capacity
+        return end, self.times[ix], self.values[ix]
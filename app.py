@@ -29,17 +29,42 @@ import os
 import glob
 import json
 import time
+import acquisition
+import assets
+import logconfig
 import maestro
+import recorder
 import re
 
 from tornado.options import define, options
 
 define("port", default=9000, help="run on the given port", type=int)
-
-devs = glob.glob("/dev/ttyACM*")
-dev_re = re.compile('ACM(\d+)')
-dev_num = min([int(dev_re.findall(x)[0]) for x in devs])
-arm = maestro.Controller(f'/dev/ttyACM{dev_num}',config_file="config.json")
+define("daemon", default="", help="unix socket of a running armd, instead of opening the serial port", type=str)
+define("production", default=False, help="cache page output, serve precompressed static files", type=bool)
+define("inputs", default="", help="comma separated input channels to stream, e.g. 6,7", type=str)
+define("input_rate", default=acquisition.DEFAULT_RATE_HZ, help="input sampling rate in Hz", type=int)
+
+arm = None
+teach = None
+inputs = None
+# number of input samples already pushed to the subscribers
+inputs_sent = 0
+
+
+def init_controller(controller=None):
+    """
+    Install the controller used by the handlers.  Without an argument connect to
+    the lowest numbered /dev/ttyACM* device; the load test passes a controller
+    backed by simulator.FakeMaestro instead.
+    """
+    global arm, teach
+    if controller is None:
+        devs = glob.glob("/dev/ttyACM*")
+        dev_re = re.compile('ACM(\d+)')
+        dev_num = min([int(dev_re.findall(x)[0]) for x in devs] or [0])
+        controller = maestro.Controller(f'/dev/ttyACM{dev_num}',config_file="config.json")
+    arm = controller
+    teach = recorder.Recorder(arm)
 
 pwm_vector = {"target_pwm": []}
 
@@ -49,7 +74,7 @@ def update_positions():
     try:
         param = {'pwm': arm.get_all_positions()}
         msg = {"cmd": cmd, "param": param}
-        logging.info("update_positions, msg = {}".format(msg))
+        logging.info("update_positions, msg = %s", msg)
     except:
         param = {'pwm': arm.get_all_positions()}
 
@@ -58,8 +83,25 @@ def update_positions():
     return msg
 
 
+def push_inputs():
+    """ Send the input samples taken since the last call to the subscribed clients """
+    global inputs_sent
+    if inputs is None:
+        return
+    inputs_sent, times, values = inputs.read_since(inputs_sent)
+    if len(times) == 0 or not WebSocketHandler.input_subscribers:
+        return
+    param = {"channels": inputs.channels, "t": times.tolist(), "values": values.tolist()}
+    msg = tornado.escape.json_encode({"cmd": "inputSamples", "param": param})
+    for waiter in list(WebSocketHandler.input_subscribers):
+        try:
+            waiter.write_message(msg)
+        except:
+            logging.error("Error sending input samples", exc_info=True)
+
+
 class Application(tornado.web.Application):
-    def __init__(self):
+    def __init__(self, debug=True, static_path=None):
         handlers = [(r"/", MainHandler), 
         (r"/ws", WebSocketHandler),
         (r"/api/(\w+)/(.*)", ApiHandler),
@@ -67,17 +109,40 @@ class Application(tornado.web.Application):
         settings = dict(
             cookie_secret="__TODO:_GENERATE_YOUR_OWN_RANDOM_VALUE_HERE__",
             template_path=os.path.join(os.path.dirname(__file__), "templates"),
-            static_path=os.path.join(os.path.dirname(__file__), "static"),
+            static_path=static_path or os.path.join(os.path.dirname(__file__), "static"),
             xsrf_cookies=True,
-            debug=True,
+            debug=debug,
         )
+        if not debug:
+            # production: static files are served precompressed with versioned,
+            # long-lived URLs, dynamic responses are gzipped
+            try:
+                assets.precompress(settings['static_path'])
+            except (IOError, OSError) as e:
+                logging.warning("Cannot precompress static files: %s", e)
+            settings.update(
+                static_handler_class=assets.PrecompressedStaticFileHandler,
+                compress_response=True,
+            )
         super(Application, self).__init__(handlers, **settings)
 
 
 class MainHandler(tornado.web.RequestHandler):
+    # (seq_files, page) of the last rendering, used when template caching is on
+    page_cache = (None, None)
+
     def get(self):
         seq_files = glob.glob("*.seq")
-        self.render("app.html", seq_files=seq_files)
+        # let the browser revalidate with the ETag instead of downloading again
+        self.set_header("Cache-Control", "no-cache")
+        if not self.settings.get("compiled_template_cache", True):
+            self.render("app.html", seq_files=seq_files)
+            return
+        key, page = MainHandler.page_cache
+        if key != seq_files:
+            page = self.render_string("app.html", seq_files=seq_files)
+            MainHandler.page_cache = (seq_files, page)
+        self.finish(page)
 
 
 class ApiHandler(tornado.web.RequestHandler):
@@ -89,7 +154,7 @@ class ApiHandler(tornado.web.RequestHandler):
 
             if "set_speed" in arg[0]:
                 for (chan, val) in enumerate(cmd_args):
-                    print("chan:{}, val:{}".format(chan, val))
+                    logging.debug("chan:%s, val:%s", chan, val)
                     arm.set_speed(chan, val)
                 ret_msg = 'done'
         except:
@@ -116,6 +181,7 @@ class ApiHandler(tornado.web.RequestHandler):
 
 class WebSocketHandler(tornado.websocket.WebSocketHandler):
     waiters = set()
+    input_subscribers = set()
     cache = []
     cache_size = 200
 
@@ -130,6 +196,7 @@ class WebSocketHandler(tornado.websocket.WebSocketHandler):
 
     def on_close(self):
         WebSocketHandler.waiters.remove(self)
+        WebSocketHandler.input_subscribers.discard(self)
 
     @classmethod
     def update_cache(cls, chat):
@@ -158,7 +225,7 @@ class WebSocketHandler(tornado.websocket.WebSocketHandler):
                 if ".seq" not in file_extension:
                     filename = filename + ".seq"
 
-                logging.info("Saving to file: {}".format(filename))
+                logging.info("Saving to file: %s", filename)
                 fid = open(filename, 'w')
                 fid.write(json.dumps(parsed))
                 fid.close()
@@ -169,17 +236,18 @@ class WebSocketHandler(tornado.websocket.WebSocketHandler):
                 arm.set_target_vector(l)
 
             if "Run" in parsed['cmd']:
-                logging.debug("Running Sequence: run {} times".format(parsed['number_of_times']))
+                logging.debug("Running Sequence: run %s times", parsed['number_of_times'])
                 for ii in range(parsed['number_of_times']):
                     for frame in parsed['body']:
                         time.sleep(frame['sleep_before'])
                         for chan in range(5):
-                            arm.set_speed(chan, frame['speed'])
+                            arm.set_speed(chan, frame['speed'], maestro.PRIORITY_BULK, defer=True)
 
                         if len(frame['target_pwm']) == 5:
                             frame['target_pwm'].append(1500)
 
-                        arm.set_target_vector(frame['target_pwm'], match_speed=frame['match_speed'], wait=True)
+                        arm.set_target_vector(frame['target_pwm'], match_speed=frame['match_speed'], wait=True,
+                                              priority=maestro.PRIORITY_BULK)
                         msg = update_positions()
                         WebSocketHandler.send_updates(tornado.escape.json_encode(msg))
                         time.sleep(frame['sleep'])
@@ -199,15 +267,41 @@ class WebSocketHandler(tornado.websocket.WebSocketHandler):
                 fid = open(filename, 'r')
                 from_file = json.loads(fid.read())
                 fid.close()
-                logging.info("loaded file {}".format(filename))
+                logging.info("loaded file %s", filename)
                 msg = {
                     "cmd": "FromLoadedFile",
                     "param": from_file,
                 }
                 WebSocketHandler.send_updates(tornado.escape.json_encode(msg))
 
+            if "StartRecording" in parsed['cmd']:
+                teach.start()
+
+            if "StopRecording" in parsed['cmd']:
+                if not teach.running:
+                    logging.warning("StopRecording without a recording in progress")
+                else:
+                    teach.stop()
+                    tolerance = parsed.get('tolerance', recorder.DEFAULT_TOLERANCE)
+                    try:
+                        seq = teach.save(parsed['filename'], tolerance)
+                    except NameError as e:
+                        logging.warning("Recording not saved: %s", e)
+                    else:
+                        msg = {
+                            "cmd": "FromLoadedFile",
+                            "param": seq,
+                        }
+                        WebSocketHandler.send_updates(tornado.escape.json_encode(msg))
+
+            if "StreamInputs" in parsed['cmd']:
+                WebSocketHandler.input_subscribers.add(self)
+
+            if "StopInputs" in parsed['cmd']:
+                WebSocketHandler.input_subscribers.discard(self)
+
             if "Set Home" in parsed['cmd']:
-                arm.config['home'] = arm.get_all_positions()
+                arm.set_home()
                 print(arm.config['home'])
 
         elif "cmd" in message:
@@ -216,7 +310,7 @@ class WebSocketHandler(tornado.websocket.WebSocketHandler):
             chan = int(parsed['id'][1])
             pwm = int(parsed["body"])
             if "L" in parsed['id'][0]:
-                logging.info("moving left arm {}".format(int(parsed["body"])))
+                logging.info("moving left arm %d", pwm)
                 arm.set_target(chan, pwm)
 
             #msg = update_positions()
@@ -235,8 +329,21 @@ class WebSocketHandler(tornado.websocket.WebSocketHandler):
 
 
 def main():
+    global inputs
+    # before parse_command_line so that tornado does not add its own handler,
+    # --logging still sets the level
+    logconfig.configure()
     tornado.options.parse_command_line()
-    app = Application()
+    if options.daemon:
+        import armd
+        init_controller(armd.RemoteController(options.daemon))
+    else:
+        init_controller()
+    if options.inputs:
+        inputs = acquisition.InputStream(arm, [int(x) for x in options.inputs.split(',')], options.input_rate)
+        inputs.start()
+        tornado.ioloop.PeriodicCallback(push_inputs, 100).start()
+    app = Application(debug=not options.production)
     app.listen(options.port, address='0.0.0.0')
     tornado.ioloop.IOLoop.current().start()
 
@@ -0,0 +1,323 @@
+#!/usr/bin/env python
+"""
+Controller daemon.
+
+armd owns the serial port and the maestro.Controller.  It publishes the live
+channel state (position, target, speed, accel) into a shared memory block that
+any number of processes can read without a serial round trip, and accepts
+commands from those processes over a local Unix socket.  The web tier uses it
+through RemoteController, which offers the parts of the Controller API that
+app.py needs:
+
+    python armd.py --tty=/dev/ttyACM0 --socket=/tmp/armd.sock
+    python app.py --daemon=/tmp/armd.sock
+
+Shared memory layout (native byte order), guarded by a seqlock: the writer
+makes the sequence number odd, updates the fields and makes it even again;
+readers retry until they see the same even number before and after copying.
+
+    uint64 seq | uint64 channels | float64 timestamp
+    float64 position[channels] | float64 target[channels]
+    float64 speed[channels]    | float64 accel[channels]
+"""
+
+import copy
+import inspect
+import json
+import logging
+import os
+import signal
+import socket
+import socketserver
+import threading
+import time
+
+from multiprocessing import shared_memory
+
+import numpy as np
+
+import tornado.options
+from tornado.options import define, options
+
+logger = logging.getLogger('maestro')
+
+STATE_FIELDS = ('position', 'target', 'speed', 'accel')
+
+# Controller methods that can be called through the socket
+REMOTE_METHODS = (
+    'set_target', 'set_target_vector', 'set_speed', 'set_speed_vector', 'set_accel',
+    'go_home', 'set_home', 'stop_script', 'run_script_sub', 'reset_device_state',
+    'get_positions', 'get_config',
+)
+
+
+class StateBlock(object):
+    """
+    Seqlock protected channel state in shared memory.  The daemon creates the block
+    with create(), readers attach() to it by name.  position, target, speed and
+    accel are NumPy views straight onto the shared buffer.
+    """
+    HEADER = 24
+
+    def __init__(self, shm, owner):
+        self.shm = shm
+        self.owner = owner
+        self.name = shm.name
+        header = np.ndarray((2,), dtype=np.uint64, buffer=shm.buf)
+        self.seq = header[0:1]
+        self.channels = int(header[1])
+        self.timestamp = np.ndarray((1,), dtype=np.float64, buffer=shm.buf, offset=16)
+        n = self.channels
+        for ix, field in enumerate(STATE_FIELDS):
+            view = np.ndarray((n,), dtype=np.float64, buffer=shm.buf, offset=self.HEADER + ix * n * 8)
+            setattr(self, field, view)
+
+    @classmethod
+    def size(cls, channels):
+        return cls.HEADER + len(STATE_FIELDS) * channels * 8
+
+    @classmethod
+    def create(cls, channels, name=None):
+        shm = shared_memory.SharedMemory(name=name, create=True, size=cls.size(channels))
+        header = np.ndarray((2,), dtype=np.uint64, buffer=shm.buf)
+        header[0] = 0
+        header[1] = channels
+        return cls(shm, owner=True)
+
+    @classmethod
+    def attach(cls, name):
+        try:
+            shm = shared_memory.SharedMemory(name=name, track=False)
+        except TypeError:
+            # Python < 3.13 registers every attached block with the resource
+            # tracker, which would unlink it when this process exits
+            shm = shared_memory.SharedMemory(name=name)
+            from multiprocessing import resource_tracker
+            resource_tracker.unregister(shm._name, 'shared_memory')
+        return cls(shm, owner=False)
+
+    def write(self, **values):
+        """ Publish new values, e.g. write(position=[...], speed=[...]) """
+        self.seq[0] += 1
+        for field, value in values.items():
+            getattr(self, field)[:] = value
+        self.timestamp[0] = time.time()
+        self.seq[0] += 1
+
+    def read(self, retries=1000):
+        """
+        Return a consistent snapshot {'timestamp': t, 'position': array, ...}.
+        Raises NameError if the writer kept the block busy for all retries.
+        """
+        for _ in range(retries):
+            seq = int(self.seq[0])
+            if seq & 1:
+                time.sleep(0)
+                continue
+            snapshot = {field: getattr(self, field).copy() for field in STATE_FIELDS}
+            snapshot['timestamp'] = float(self.timestamp[0])
+            if int(self.seq[0]) == seq:
+                return snapshot
+        raise NameError("StateBlock.read() - could not get a consistent snapshot")
+
+    def close(self):
+        # drop the views before releasing the buffer
+        self.seq = self.timestamp = None
+        for field in STATE_FIELDS:
+            setattr(self, field, None)
+        self.shm.close()
+        if self.owner:
+            self.shm.unlink()
+
+
+class RequestHandler(socketserver.StreamRequestHandler):
+    """ One JSON request per line, answered with one JSON reply per line """
+    def handle(self):
+        for line in self.rfile:
+            reply = self.server.armd.dispatch(line)
+            self.wfile.write(json.dumps(reply).encode('utf-8') + b'\n')
+            self.wfile.flush()
+
+
+class ControllerDaemon(object):
+    """
+    Serves a maestro.Controller on a Unix socket and publishes its state.
+
+    Requests and replies are JSON lines:
+        {"method": "set_target", "args": [0, 1500], "kwargs": {}}
+        {"result": null}  or  {"error": "..."}
+    The "hello" method returns the name of the shared memory block.  Every client
+    connection has its own thread; calls into the controller, including the
+    state publisher, are serialised by a lock.  Moves are queued under the lock
+    and waited for (wait=True) outside it, so other clients and the publisher
+    keep running while the arm moves.
+    """
+    def __init__(self, arm, socket_path, shm_name=None, rate_hz=50):
+        self.arm = arm
+        self.socket_path = socket_path
+        self.rate_hz = rate_hz
+        self.state = StateBlock.create(arm.config['num_of_channels'], shm_name)
+        self.lock = threading.Lock()
+        self.running = False
+        self.publisher = None
+        self.server = None
+        self.server_thread = None
+
+    def start(self):
+        if os.path.exists(self.socket_path):
+            os.remove(self.socket_path)
+        self.server = socketserver.ThreadingUnixStreamServer(self.socket_path, RequestHandler)
+        self.server.daemon_threads = True
+        self.server.armd = self
+        self.running = True
+        self.publish()
+        self.publisher = threading.Thread(target=self._publish_loop, name='armd-publisher')
+        self.publisher.daemon = True
+        self.publisher.start()
+        self.server_thread = threading.Thread(target=self.server.serve_forever, name='armd-server')
+        self.server_thread.daemon = True
+        self.server_thread.start()
+        logger.info("armd listening on {}, state in shared memory {}".format(self.socket_path, self.state.name))
+
+    def stop(self):
+        self.running = False
+        if self.server is not None:
+            self.server.shutdown()
+            self.server.server_close()
+            self.server.armd = None
+            self.server = None
+        if self.publisher is not None:
+            self.publisher.join()
+            self.publisher = None
+        self.state.close()
+        if os.path.exists(self.socket_path):
+            os.remove(self.socket_path)
+
+    def dispatch(self, line):
+        try:
+            request = json.loads(line)
+            method = request['method']
+            if method == 'hello':
+                return {'result': {'shm': self.state.name, 'channels': self.state.channels}}
+            if method not in REMOTE_METHODS:
+                raise NameError("Method not allowed: {}".format(method))
+            with self.lock:
+                if method == 'get_config':
+                    return {'result': copy.deepcopy(self.arm.config)}
+                func = getattr(self.arm, method)
+                call = inspect.signature(func).bind(*request.get('args', []), **request.get('kwargs', {}))
+                call.apply_defaults()
+                # moves are only queued under the lock, the wait for them to finish
+                # happens on this client's thread
+                wait = call.arguments.get('wait', False)
+                if wait:
+                    call.arguments['wait'] = False
+                result = func(*call.args, **call.kwargs)
+            if wait and result:
+                time.sleep(result)
+            return {'result': result}
+        except Exception as e:
+            logger.error("armd request failed: %s", e)
+            return {'error': str(e)}
+
+    def publish(self):
+        with self.lock:
+            config = self.arm.config
+            self.state.write(position=self.arm.get_all_positions(),
+                             target=config['target_position'],
+                             speed=config['speed'],
+                             accel=config['accel'])
+
+    def _publish_loop(self):
+        period = 1.0 / self.rate_hz
+        while self.running:
+            start_time = time.time()
+            try:
+                self.publish()
+            except Exception as e:
+                logger.error("armd publish failed: %s", e)
+            time.sleep(max(0.0, period - (time.time() - start_time)))
+
+
+class RemoteController(object):
+    """
+    Client side of ControllerDaemon.  Positions are read from the shared memory
+    block, all other calls are forwarded over the socket.  Safe to share between
+    threads.
+    """
+    def __init__(self, socket_path):
+        self.socket_path = socket_path
+        self.lock = threading.Lock()
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.sock.connect(socket_path)
+        self.stream = self.sock.makefile('rwb')
+        hello = self.call('hello')
+        self.state = StateBlock.attach(hello['shm'])
+        self.tty_port_connection_established = True
+
+    def call(self, method, *args, **kwargs):
+        request = json.dumps({'method': method, 'args': args, 'kwargs': kwargs})
+        with self.lock:
+            self.stream.write(request.encode('utf-8') + b'\n')
+            self.stream.flush()
+            line = self.stream.readline()
+        if not line:
+            raise NameError("armd closed the connection")
+        reply = json.loads(line)
+        if 'error' in reply:
+            raise NameError(reply['error'])
+        return reply['result']
+
+    def __getattr__(self, name):
+        if name in REMOTE_METHODS:
+            return lambda *args, **kwargs: self.call(name, *args, **kwargs)
+        raise AttributeError(name)
+
+    @property
+    def config(self):
+        """ Snapshot of the daemon's configuration (changes to it are not sent back) """
+        return self.call('get_config')
+
+    def get_position(self, chan):
+        return float(self.state.read()['position'][chan])
+
+    def get_all_positions(self):
+        return self.state.read()['position'].tolist()
+
+    def close(self):
+        self.state.close()
+        self.stream.close()
+        self.sock.close()
+
+
+define("tty", default="/dev/ttyACM0", help="serial port of the Maestro", type=str)
+define("socket", default="/tmp/armd.sock", help="unix socket to accept commands on", type=str)
+define("shm", default="armd-state", help="name of the shared memory state block", type=str)
+define("rate", default=50, help="state publish rate in Hz", type=int)
+define("config", default="config.json", help="controller config file", type=str)
+define("sim", default=False, help="use simulator.FakeMaestro instead of the serial port", type=bool)
+
+
+def main():
+    import logconfig
+    import maestro
+    import simulator
+
+    logconfig.configure()
+    tornado.options.parse_command_line()
+    usb = simulator.FakeMaestro() if options.sim else None
+    arm = maestro.Controller(options.tty, config_file=options.config, usb=usb)
+    daemon = ControllerDaemon(arm, options.socket, options.shm, options.rate)
+    daemon.start()
+
+    stop = threading.Event()
+    signal.signal(signal.SIGTERM, lambda *args: stop.set())
+    signal.signal(signal.SIGINT, lambda *args: stop.set())
+    while not stop.is_set():
+        stop.wait(1)
+    daemon.stop()
+    arm.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,112 @@
+#!/usr/bin/env python
+"""
+Production serving of the static assets.
+
+precompress() writes .gz (and .br when the brotli module is installed) next to
+every compressible file in static/.  PrecompressedStaticFileHandler serves
+those variants directly to clients that accept them, so nothing is compressed
+per request.  Together with the versioned URLs from static_url() the files are
+cached by the browser for a year and revalidated by ETag.
+
+    python assets.py static
+"""
+
+import gzip
+import mimetypes
+import os
+import sys
+
+import tornado.web
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+COMPRESSIBLE = ('.js', '.css', '.map', '.html', '.json', '.svg', '.ico', '.txt')
+
+# (Accept-Encoding token, file suffix), most preferred first
+ENCODINGS = (('br', '.br'), ('gzip', '.gz'))
+
+IMMUTABLE_CACHE_CONTROL = "public, max-age=31536000, immutable"
+
+
+def _is_fresh(variant, source):
+    return os.path.exists(variant) and os.path.getmtime(variant) >= os.path.getmtime(source)
+
+
+def precompress(static_path):
+    """
+    Create or refresh the .gz / .br variants of the assets under static_path.
+    Variants that would not be smaller than the original are not written.
+    Returns the list of files written.
+    """
+    written = []
+    for root, dirs, files in os.walk(static_path):
+        for name in files:
+            if not name.endswith(COMPRESSIBLE):
+                continue
+            source = os.path.join(root, name)
+            with open(source, 'rb') as fid:
+                data = None
+                for encoding, suffix in ENCODINGS:
+                    if encoding == 'br' and brotli is None:
+                        continue
+                    variant = source + suffix
+                    if _is_fresh(variant, source):
+                        continue
+                    if data is None:
+                        data = fid.read()
+                    if encoding == 'br':
+                        packed = brotli.compress(data)
+                    else:
+                        packed = gzip.compress(data, 9)
+                    if len(packed) >= len(data):
+                        continue
+                    with open(variant, 'wb') as out:
+                        out.write(packed)
+                    written.append(variant)
+    return written
+
+
+class PrecompressedStaticFileHandler(tornado.web.StaticFileHandler):
+    """
+    StaticFileHandler that serves a fresh .br or .gz variant of the requested
+    file when the client accepts that encoding.  The ETag is computed from the
+    bytes sent, so every encoding gets its own.  Versioned URLs (?v=...) are
+    marked immutable.
+    """
+    def validate_absolute_path(self, root, absolute_path):
+        absolute_path = super(PrecompressedStaticFileHandler, self).validate_absolute_path(root, absolute_path)
+        self.content_encoding = None
+        if absolute_path is None or not os.path.isfile(absolute_path):
+            return absolute_path
+        self.source_path = absolute_path
+        accepted = [x.split(';')[0].strip() for x in self.request.headers.get('Accept-Encoding', '').split(',')]
+        for encoding, suffix in ENCODINGS:
+            if encoding in accepted and _is_fresh(absolute_path + suffix, absolute_path):
+                self.content_encoding = encoding
+                return absolute_path + suffix
+        return absolute_path
+
+    def get_content_type(self):
+        # the type of the original file, not application/gzip of the variant
+        mime_type, encoding = mimetypes.guess_type(getattr(self, 'source_path', self.absolute_path))
+        if encoding is None and mime_type is not None:
+            return mime_type
+        return "application/octet-stream"
+
+    def set_extra_headers(self, path):
+        if not self.settings.get('compress_response'):
+            # otherwise added by the gzip transform
+            self.set_header("Vary", "Accept-Encoding")
+        if self.content_encoding:
+            self.set_header("Content-Encoding", self.content_encoding)
+        if self.get_argument("v", None):
+            self.set_header("Cache-Control", IMMUTABLE_CACHE_CONTROL)
+
+
+if __name__ == "__main__":
+    for path in sys.argv[1:] or [os.path.join(os.path.dirname(__file__), "static")]:
+        for variant in precompress(path):
+            print(variant)
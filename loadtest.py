@@ -0,0 +1,348 @@
+#!/usr/bin/env python
+"""
+WebSocket load test for app.py against a simulated arm.
+
+For every client count in --clients a fresh server process is started with the
+controller backed by simulator.FakeMaestro.  The clients connect to /ws, send a
+mix of jog, Update, Run and Loadfile messages for --duration seconds and the
+run reports message throughput, broadcast latency, event-loop lag and server
+CPU / memory.  The first client count whose p99 broadcast latency exceeds
+--max_latency (or that fails to connect all clients) is reported as the
+breaking point.  Nothing but the loopback interface is used.
+
+    python loadtest.py --clients=50,100,200,400 --duration=20
+"""
+
+import json
+import logging
+import multiprocessing
+import os
+import random
+import resource
+import shutil
+import tempfile
+import time
+
+import tornado.gen
+import tornado.httpserver
+import tornado.ioloop
+import tornado.locks
+import tornado.options
+import tornado.testing
+import tornado.websocket
+
+from tornado.options import define, options
+
+define("clients", default="50,100,200", help="comma separated client counts to sweep", type=str)
+define("duration", default=10.0, help="seconds of load for every client count", type=float)
+define("rate", default=2.0, help="messages per second sent by each client", type=float)
+define("mix", default="jog=70,update=20,loadfile=8,run=2", help="weights of the message types", type=str)
+define("probe_interval", default=0.25, help="seconds between broadcast latency probes", type=float)
+define("max_latency", default=0.5, help="p99 broadcast latency (sec) at which the server counts as broken", type=float)
+define("baud", default=115200, help="simulated serial link speed, 0 disables the wire delay", type=int)
+define("server_log", default="warning", help="log level of the server process", type=str)
+
+LAG_INTERVAL = 0.01  # sec between event-loop lag samples
+CONNECT_CONCURRENCY = 50
+CONNECT_TIMEOUT = 10
+
+
+def percentile(values, pct):
+    if not values:
+        return float('nan')
+    values = sorted(values)
+    ix = min(len(values) - 1, int(round(pct / 100.0 * (len(values) - 1))))
+    return values[ix]
+
+
+def rss_kb():
+    """ Resident set size of the current process in KB (Linux only, 0 elsewhere) """
+    try:
+        with open('/proc/self/statm') as fid:
+            return int(fid.read().split()[1]) * os.sysconf('SC_PAGE_SIZE') // 1024
+    except (IOError, OSError, ValueError):
+        return 0
+
+
+# ---------------------------
+# Server process
+# ---------------------------
+
+def serve(conn, baud, log_level):
+    """
+    Run app.Application with a simulated arm until the parent sends "stop".
+    Reports ("ready", port) once listening and replies to "stop" with the stats.
+    """
+    import logconfig
+    logconfig.configure(level=getattr(logging, log_level.upper()))
+    import app
+    import maestro
+    import simulator
+
+    workdir = tempfile.mkdtemp(prefix='arm-loadtest-')
+    config_file = os.path.join(workdir, 'maestro.json')
+    with open(config_file, 'w') as fid:
+        fid.write(json.dumps(maestro.DEFAULT_CONFIG))
+    arm = maestro.Controller('sim', config_file=config_file, usb=simulator.FakeMaestro(baud=baud))
+    app.init_controller(arm)
+    # SaveFile and the sequence list of MainHandler work on the current directory
+    os.chdir(workdir)
+
+    # production mode precompresses the static files in place, use a copy
+    static_path = os.path.join(workdir, 'static')
+    shutil.copytree(os.path.join(os.path.dirname(os.path.abspath(app.__file__)), 'static'), static_path)
+
+    sock, port = tornado.testing.bind_unused_port()
+    server = tornado.httpserver.HTTPServer(app.Application(debug=False, static_path=static_path))
+    server.add_sockets([sock])
+    loop = tornado.ioloop.IOLoop.current()
+
+    state = {}
+
+    def reset():
+        usage = resource.getrusage(resource.RUSAGE_SELF)
+        state['lag'] = []
+        state['last_tick'] = time.monotonic()
+        state['start'] = time.monotonic()
+        state['cpu'] = usage.ru_utime + usage.ru_stime
+        state['commands'] = arm.usb.commands
+        state['bytes'] = arm.usb.bytes_received
+        state['writes'] = arm.writer.writes
+
+    def tick():
+        now = time.monotonic()
+        state['lag'].append(max(0.0, now - state['last_tick'] - LAG_INTERVAL))
+        state['last_tick'] = now
+
+    def stats():
+        usage = resource.getrusage(resource.RUSAGE_SELF)
+        wall = time.monotonic() - state['start']
+        return {
+            'wall': wall,
+            'cpu_percent': 100.0 * (usage.ru_utime + usage.ru_stime - state['cpu']) / wall,
+            'max_rss_kb': usage.ru_maxrss,
+            'rss_kb': rss_kb(),
+            'lag_p50': percentile(state['lag'], 50),
+            'lag_p99': percentile(state['lag'], 99),
+            'lag_max': max(state['lag'] or [float('nan')]),
+            'serial_commands': arm.usb.commands - state['commands'],
+            'serial_bytes': arm.usb.bytes_received - state['bytes'],
+            'serial_writes': arm.writer.writes - state['writes'],
+        }
+
+    def poll():
+        while conn.poll():
+            msg = conn.recv()
+            if msg == 'reset':
+                reset()
+            elif msg == 'stop':
+                conn.send(stats())
+                server.stop()
+                arm.close()
+                loop.stop()
+
+    reset()
+    tornado.ioloop.PeriodicCallback(tick, LAG_INTERVAL * 1000).start()
+    tornado.ioloop.PeriodicCallback(poll, 50).start()
+    conn.send(('ready', port))
+    loop.start()
+
+
+# ---------------------------
+# Clients
+# ---------------------------
+
+class Stats(object):
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        self.sent = 0
+        self.received = 0
+        self.errors = 0
+        self.latency = []
+        # send time of every probe and how many of them the probe client got back
+        self.probe_times = []
+        self.probe_echoes = 0
+
+
+def frame(ix):
+    return {
+        'frame': ix,
+        'target_pwm': [random.randint(1450, 1550) for _ in range(5)],
+        'speed': 1000,
+        'sleep': 0,
+        'sleep_before': 0,
+        'match_speed': True,
+    }
+
+
+def make_message(kind, seq_file):
+    if kind == 'jog':
+        chan = random.randint(0, 4)
+        return {"id": "L{}".format(chan), "cmd": "move", "body": str(random.randint(1400, 1600))}
+    if kind == 'update':
+        return {"id": "button", "cmd": "Update",
+                "body": {"target_pwm": [random.randint(1450, 1550) for _ in range(5)]}}
+    if kind == 'run':
+        return {"id": "button", "cmd": "Run", "number_of_times": 1, "body": [frame(0), frame(1)]}
+    if kind == 'loadfile':
+        return {"id": "button", "cmd": "Loadfile", "filename": seq_file}
+    raise NameError("unknown message type: {}".format(kind))
+
+
+def write_seq_file(directory, name, probe):
+    filename = os.path.join(directory, name + '.seq')
+    with open(filename, 'w') as fid:
+        fid.write(json.dumps({"id": "button", "cmd": "SaveFile", "filename": name,
+                              "probe": probe, "body": [frame(0), frame(1)]}))
+    return filename
+
+
+async def read_loop(ws, stats, is_probe):
+    # broadcasts reach every client in the same order, so the n-th probe
+    # broadcast a client receives belongs to the n-th probe sent
+    probes = 0
+    while True:
+        msg = await ws.read_message()
+        if msg is None:
+            return
+        stats.received += 1
+        if '"probe": true' not in msg:
+            continue
+        if probes < len(stats.probe_times):
+            stats.latency.append(time.monotonic() - stats.probe_times[probes])
+        probes += 1
+        if is_probe:
+            stats.probe_echoes = probes
+
+
+async def send_loop(ws, stats, kinds, weights, seq_file, stop_at):
+    while time.monotonic() < stop_at:
+        await tornado.gen.sleep(random.expovariate(options.rate))
+        kind = random.choices(kinds, weights)[0]
+        try:
+            await ws.write_message(json.dumps(make_message(kind, seq_file)))
+            stats.sent += 1
+        except tornado.websocket.WebSocketClosedError:
+            stats.errors += 1
+            return
+
+
+async def probe_loop(ws, stats, probe_file, stop_at):
+    """ Send one Loadfile probe at a time and wait for its broadcast before the next """
+    msg = json.dumps(make_message('loadfile', probe_file))
+    while time.monotonic() < stop_at:
+        await tornado.gen.sleep(options.probe_interval)
+        if stats.probe_echoes == len(stats.probe_times):
+            stats.probe_times.append(time.monotonic())
+            try:
+                await ws.write_message(msg)
+            except tornado.websocket.WebSocketClosedError:
+                stats.errors += 1
+                return
+
+
+async def connect(url, semaphore):
+    async with semaphore:
+        try:
+            return await tornado.websocket.websocket_connect(url, connect_timeout=CONNECT_TIMEOUT)
+        except Exception:
+            return None
+
+
+async def run_level(num_clients, seq_dir):
+    kinds, weights = [], []
+    for item in options.mix.split(','):
+        kind, weight = item.split('=')
+        kinds.append(kind.strip())
+        weights.append(float(weight))
+    seq_file = write_seq_file(seq_dir, 'load', False)
+    probe_file = write_seq_file(seq_dir, 'probe', True)
+
+    ctx = multiprocessing.get_context('spawn')
+    parent_conn, child_conn = ctx.Pipe()
+    server = ctx.Process(target=serve, args=(child_conn, options.baud, options.server_log))
+    server.start()
+    _, port = parent_conn.recv()
+    url = "ws://127.0.0.1:{}/ws".format(port)
+
+    # one extra connection carries the latency probes
+    semaphore = tornado.locks.Semaphore(CONNECT_CONCURRENCY)
+    conns = await tornado.gen.multi([connect(url, semaphore) for _ in range(num_clients + 1)])
+    probe, clients = conns[0], [c for c in conns[1:] if c is not None]
+    connect_failures = num_clients - len(clients)
+
+    stats = Stats()
+    for ws in conns:
+        if ws is not None:
+            tornado.ioloop.IOLoop.current().spawn_callback(read_loop, ws, stats, ws is probe)
+    # let the open() broadcasts of the ramp-up settle before measuring
+    await tornado.gen.sleep(1)
+    stats.reset()
+    parent_conn.send('reset')
+
+    start = time.monotonic()
+    stop_at = start + options.duration
+    jobs = [send_loop(ws, stats, kinds, weights, seq_file, stop_at) for ws in clients]
+    if probe is not None:
+        jobs.append(probe_loop(probe, stats, probe_file, stop_at))
+    await tornado.gen.multi(jobs)
+    elapsed = time.monotonic() - start
+
+    parent_conn.send('stop')
+    server_stats = parent_conn.recv()
+    for ws in conns:
+        if ws is not None:
+            ws.close()
+    server.join()
+
+    result = {
+        'clients': num_clients,
+        'connect_failures': connect_failures,
+        'sent_per_sec': stats.sent / elapsed,
+        'received_per_sec': stats.received / elapsed,
+        'errors': stats.errors,
+        'probes_sent': len(stats.probe_times),
+        'latency_p50': percentile(stats.latency, 50),
+        'latency_p99': percentile(stats.latency, 99),
+    }
+    result.update(server_stats)
+    return result
+
+
+def report(result):
+    print("clients={clients:5d}  connect_failures={connect_failures}  errors={errors}\n"
+          "  throughput: sent {sent_per_sec:8.1f} msg/s, received {received_per_sec:9.1f} msg/s\n"
+          "  broadcast latency: p50 {latency_p50:.4f}s p99 {latency_p99:.4f}s ({probes_sent} probes)\n"
+          "  event-loop lag: p50 {lag_p50:.4f}s p99 {lag_p99:.4f}s max {lag_max:.4f}s\n"
+          "  server: cpu {cpu_percent:5.1f}%  rss {rss_kb} KB  max rss {max_rss_kb} KB\n"
+          "  serial: {serial_commands} commands, {serial_bytes} bytes in {serial_writes} writes".format(**result))
+
+
+def is_broken(result):
+    return (result['connect_failures'] > 0 or
+            not result['latency_p99'] <= options.max_latency)
+
+
+async def run():
+    seq_dir = tempfile.mkdtemp(prefix='arm-loadtest-seq-')
+    breaking_point = None
+    for num_clients in [int(x) for x in options.clients.split(',')]:
+        result = await run_level(num_clients, seq_dir)
+        report(result)
+        if breaking_point is None and is_broken(result):
+            breaking_point = num_clients
+    if breaking_point is None:
+        print("server kept p99 broadcast latency under {}s for every client count".format(options.max_latency))
+    else:
+        print("breaking point: {} clients".format(breaking_point))
+
+
+def main():
+    tornado.options.parse_command_line()
+    tornado.ioloop.IOLoop.current().run_sync(run)
+
+
+if __name__ == "__main__":
+    main()
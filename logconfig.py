@@ -0,0 +1,93 @@
+"""
+Logging setup shared by app.py, armd.py and loadtest.py.
+
+configure() is the one place where handlers are installed.  Records are put on
+an in-process queue by the calling thread and formatted and written by a
+QueueListener thread, so a control path only pays for creating the record and
+merging its arguments into the message.  RateLimitFilter drops high-frequency
+INFO/DEBUG records per call site before they reach the queue.  Use %-style
+arguments (logger.debug("x=%s", x)) so nothing is formatted for records that
+are filtered out.
+"""
+
+import atexit
+import logging
+import logging.handlers
+import queue
+import time
+
+FORMAT = '%(filename)10s:%(lineno)3d - %(levelname)10s - %(message)s'
+
+_listener = None
+
+
+class RateLimitFilter(logging.Filter):
+    """
+    Lets through at most `rate` records per second from every call site
+    (logger, file and line).  Records above `max_level` are never dropped.  The
+    next record let through from a call site reports how many were dropped.
+    """
+    def __init__(self, rate=10, max_level=logging.INFO):
+        super(RateLimitFilter, self).__init__()
+        self.rate = float(rate)
+        self.max_level = max_level
+        self.buckets = {}
+
+    def filter(self, record):
+        if record.levelno > self.max_level or self.rate <= 0:
+            return True
+        key = (record.name, record.pathname, record.lineno)
+        now = time.monotonic()
+        tokens, last, suppressed = self.buckets.get(key, (self.rate, now, 0))
+        tokens = min(self.rate, tokens + (now - last) * self.rate)
+        if tokens < 1:
+            self.buckets[key] = (tokens, now, suppressed + 1)
+            return False
+        if suppressed:
+            record.msg = "{} [{} similar messages suppressed]".format(record.msg, suppressed)
+        self.buckets[key] = (tokens - 1, now, 0)
+        return True
+
+
+class DeferredQueueHandler(logging.handlers.QueueHandler):
+    """
+    QueueHandler that leaves most of the formatting to the listener thread.
+    Only msg % args is resolved in the calling thread, once the record has
+    passed the filters: the arguments are often lists or dicts of live control
+    state that may change before the listener gets to them.  The layout,
+    timestamp and exception text are done by the listener's handlers.
+    """
+    def prepare(self, record):
+        record.msg = record.getMessage()
+        record.args = None
+        return record
+
+
+def configure(level=logging.INFO, rate_limit=10, handlers=None):
+    """
+    Route the root logger through a background queue listener.  handlers default
+    to a console handler; rate_limit is the number of INFO/DEBUG records per
+    second and call site that are kept (0 disables rate limiting).  Calling it
+    again only updates the level.  Returns the QueueListener.
+    """
+    global _listener
+    root = logging.getLogger()
+    root.setLevel(level)
+    if _listener is not None:
+        return _listener
+
+    if handlers is None:
+        console = logging.StreamHandler()
+        console.setFormatter(logging.Formatter(FORMAT))
+        handlers = [console]
+
+    log_queue = queue.Queue(-1)
+    queue_handler = DeferredQueueHandler(log_queue)
+    if rate_limit:
+        queue_handler.addFilter(RateLimitFilter(rate_limit))
+    root.addHandler(queue_handler)
+
+    _listener = logging.handlers.QueueListener(log_queue, *handlers, respect_handler_level=True)
+    _listener.start()
+    atexit.register(_listener.stop)
+    return _listener
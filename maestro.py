@@ -5,23 +5,15 @@ from sys import version_info
 import os
 import logging
 import copy
+import threading
+import itertools
+import weakref
+from collections import deque
 
 PY2 = version_info[0] == 2  # Running Python 2.x?
 
+# Handlers are installed by the application, see logconfig.configure().
 logger = logging.getLogger('maestro')
-logger.setLevel(logging.INFO)
-# create console handler with a higher log level
-ch = logging.StreamHandler()
-ch.setLevel(logging.DEBUG)
-formatter = logging.Formatter('%(filename)10s:%(lineno)3d - %(levelname)10s - %(message)s')
-ch.setFormatter(formatter)
-logger.addHandler(ch)
-
-# create file handler which logs even debug messages
-# fh = logging.FileHandler('maestro.log')
-# fh.setLevel(logging.DEBUG)
-# fh.setFormatter(formatter)
-# logger.addHandler(fh)
 
 
 #
@@ -41,6 +33,25 @@ logger.addHandler(ch)
 str_to_byte = {
 }
 
+# Priority lanes of the serial writer, lower number is written first.
+PRIORITY_HIGH = 0    # stop, home and other safety commands
+PRIORITY_NORMAL = 1  # interactive jog and configuration commands
+PRIORITY_BULK = 2    # sequence playback and other streaming traffic
+
+# Commands whose queued packet is replaced by a newer one for the same channel:
+# set target, set speed, set acceleration.
+SUPERSEDED_COMMANDS = (chr(0x04), chr(0x07), chr(0x09))
+
+# Serial protocols.  The Pololu protocol prefixes every command with 0xAA and the
+# device number so that daisy-chained Maestros can be addressed individually, the
+# compact protocol sends just the command byte (with the high bit set).
+PROTOCOL_AUTO = 'auto'
+PROTOCOL_POLOLU = 'pololu'
+PROTOCOL_COMPACT = 'compact'
+
+# Device number a Maestro answers to out of the box.
+DEFAULT_DEVICE = 0x0c
+
 DEFAULT_CONFIG = {
     'min': [500, 500, 500, 500, 500, 500],
     'max': [2500, 2500, 2500, 2500, 2500, 2500],
@@ -53,7 +64,8 @@ DEFAULT_CONFIG = {
     'last_speed': [-1,-1,-1,-1,-1,-1],
     'timeout': 1,
     'delay_adjust' : 1,
-    'num_of_channels' : 6
+    'num_of_channels' : 6,
+    'daisy_chain' : False
 }
 
 def load_config_file(filename="maestro.json"):
@@ -95,6 +107,128 @@ def ang_2_pwm(ang, cal):
 
     return round(pwm)
 
+class SerialWriter(object):
+    """
+    Owns the write side of the serial port through a single background thread.
+
+    Producers on any thread call put() which appends the packet to one of the
+    priority lanes (a deque, append/popleft are atomic so no lock is taken) and
+    wakes the writer.  On every wake-up the writer drains the lanes in priority
+    order and sends everything it collected with one usb.write() call, so
+    packets are never interleaved and small packets share a single syscall.
+
+    Packets put with a key (command and channel, see Controller.send) replace
+    the older packets with the same key that are still queued in any lane, so
+    priority ordering never lets a stale target or speed overwrite a newer one.
+    on_error is called from the writer thread when a write fails.
+    """
+    def __init__(self, usb, lanes=3, poll_interval=0.5, on_error=None):
+        self.usb = usb
+        self.lanes = [deque() for _ in range(lanes)]
+        self.poll_interval = poll_interval
+        self.on_error = on_error
+        self.wakeup = threading.Event()
+        self.running = False
+        self.thread = None
+        # next() on itertools.count is atomic, it orders packets across lanes
+        self.sequence = itertools.count()
+        self.writes = 0
+        self.bytes_written = 0
+        self.superseded = 0
+        self.last_exception = ''
+
+    def start(self):
+        if self.running:
+            return
+        self.running = True
+        self.thread = threading.Thread(target=self._run, name='maestro-writer')
+        self.thread.daemon = True
+        self.thread.start()
+
+    def stop(self, timeout=1):
+        """ Write out whatever is still queued and stop the writer thread """
+        self.running = False
+        self.wakeup.set()
+        if self.thread is not None:
+            self.thread.join(timeout)
+            self.thread = None
+
+    def put(self, packet, priority=PRIORITY_NORMAL, key=None):
+        """ Queue a packet (bytes) for writing """
+        priority = min(max(priority, 0), len(self.lanes) - 1)
+        self.lanes[priority].append((next(self.sequence), key, packet))
+        self.wakeup.set()
+
+    def flush(self, timeout=None):
+        """
+        Block until every packet queued before this call has been written.
+        Returns False on timeout.
+        """
+        if not self.running:
+            self._drain()
+            return True
+        done = threading.Event()
+        self.lanes[-1].append(done)
+        self.wakeup.set()
+        return done.wait(timeout)
+
+    def _run(self):
+        while self.running:
+            self.wakeup.wait(self.poll_interval)
+            self.wakeup.clear()
+            self._drain()
+        self._drain()
+
+    def _drain(self):
+        items = []
+        markers = []
+        pending = []
+        while True:
+            found = []
+            for lane in self.lanes:
+                while lane:
+                    item = lane.popleft()
+                    if isinstance(item, threading.Event):
+                        found.append(item)
+                    else:
+                        items.append(item)
+            # A packet put on a lane this pass had already passed is collected by
+            # the next pass, so a flush marker is only released one pass after it
+            # was found.
+            markers.extend(pending)
+            pending = found
+            if not pending:
+                break
+        self._write(self._supersede(items))
+        for marker in markers:
+            marker.set()
+
+    def _supersede(self, items):
+        """ Packets of items in order, without those replaced by a newer packet with the same key """
+        latest = {}
+        for seq, key, packet in items:
+            if key is not None and latest.get(key, -1) < seq:
+                latest[key] = seq
+        batch = [packet for seq, key, packet in items if key is None or latest[key] == seq]
+        self.superseded += len(items) - len(batch)
+        return batch
+
+    def _write(self, batch):
+        if not batch:
+            return
+        data = b''.join(batch)
+        try:
+            self.usb.write(data)
+            self.writes += 1
+            self.bytes_written += len(data)
+        except Exception as e:
+            # without the traceback, its frames would keep the callers alive
+            self.last_exception = e.with_traceback(None)
+            logger.error("SerialWriter failed to write %d bytes: %s", len(data), e)
+            if self.on_error is not None:
+                self.on_error()
+
+
 class Controller:
     """
     When connected via USB, the Maestro creates two virtual serial ports
@@ -108,20 +242,35 @@ class Controller:
     assumes.  If two or more controllers are connected to different serial
     ports, or you are using a Windows OS, you can provide the tty port.  For
     example, '/dev/ttyACM2' or for Windows, something like 'COM3'.
+
+    An already open serial-like object can be passed as usb (for example a
+    simulator.FakeMaestro), in which case tty_str is only used for logging.
+
+    protocol selects PROTOCOL_POLOLU or PROTOCOL_COMPACT.  With PROTOCOL_AUTO the
+    compact protocol is only used when the config file sets 'daisy_chain' to false
+    and the device number is DEFAULT_DEVICE.
     """
-    def __init__(self, tty_str='/dev/ttyACM0', device=0x0c,config_file="maestro.json"):
+    def __init__(self, tty_str='/dev/ttyACM0', device=DEFAULT_DEVICE,config_file="maestro.json", usb=None,
+                 protocol=PROTOCOL_AUTO):
 
         self.tty_str = tty_str
+        self.usb = usb
         self.tty_port_exists = False
         self.tty_port_connection_established = False
         # Command lead-in and device number are sent for each Pololu serial command.
         self.timeout = 1
         self.last_cmd_send = ''
         self.config_file = config_file
+        self.device = device
+        self.protocol = protocol
+        self.active_protocol = PROTOCOL_POLOLU
         self.pololu_cmd = chr(0xaa) + chr(device)
         self.last_exception = ''
         self.last_set_target_vector = []
         self.last_speed = []
+        self.writer = None
+        # Serialises request/response pairs (get_position) between threads.
+        self.read_lock = threading.Lock()
 
         # Track target position for each servo. The function is_moving() will
         # use the Target vs Current servo position to determine if movement is
@@ -148,10 +297,15 @@ class Controller:
         try:
             logger.info("Load config fule: {}".format(self.config_file))
             self.config = load_config_file(self.config_file)
+            self.reset_device_state()
+            self.select_protocol(self.protocol)
 
-            if os.path.exists(self.tty_str):
+            if self.usb is not None or os.path.exists(self.tty_str):
                 logger.debug("Found {} on the path".format(self.tty_str))
-                self.usb = serial.Serial(self.tty_str, 115200, timeout=1)
+                if self.usb is None:
+                    self.usb = serial.Serial(self.tty_str, 115200, timeout=1)
+                self.writer = self.new_writer()
+                self.writer.start()
                 self.tty_port_exists = True
                 self.last_set_target_vector = self.get_all_positions()
                 
@@ -166,6 +320,59 @@ class Controller:
             self.last_exception = e
             logger.error("Cannot connect to the controller. last_exception = {}".format(e))
     
+    def new_writer(self):
+        """
+        SerialWriter for self.usb that resets the device state shadow when a write
+        fails, as the device then no longer holds the recorded values.  It refers
+        to the controller weakly so the writer thread does not keep it alive.
+        """
+        ref = weakref.ref(self)
+
+        def on_error():
+            arm = ref()
+            if arm is not None:
+                arm.reset_device_state()
+        return SerialWriter(self.usb, on_error=on_error)
+
+    def select_protocol(self, protocol=PROTOCOL_AUTO):
+        """
+        Choose between the Pololu and the compact serial protocol.  The compact protocol
+        saves the two byte 0xAA/device prefix of every command but is obeyed by every
+        Maestro on the line, so PROTOCOL_AUTO only picks it for a link configured as
+        single device ('daisy_chain': false).
+        """
+        if protocol == PROTOCOL_AUTO:
+            # a non-default device number only matters when other Maestros share the line,
+            # and without 'daisy_chain' in the config the line may well be shared
+            if self.config.get('daisy_chain', True) or self.device != DEFAULT_DEVICE:
+                protocol = PROTOCOL_POLOLU
+            else:
+                protocol = PROTOCOL_COMPACT
+            if 'daisy_chain' not in self.config:
+                logger.info("'daisy_chain' is not set in %s - set it to false on a single "
+                            "device link to use the compact protocol", self.config_file)
+        if protocol == PROTOCOL_POLOLU:
+            self.pololu_cmd = chr(0xaa) + chr(self.device)
+        elif protocol == PROTOCOL_COMPACT:
+            self.pololu_cmd = ''
+        else:
+            raise NameError("Unknown protocol: {}".format(protocol))
+        logger.info("Using {} protocol".format(protocol))
+        self.active_protocol = protocol
+
+    def reset_device_state(self):
+        """
+        Forget the shadow copy of the device-side speed/accel/target values so the
+        next command for every channel is sent unconditionally.  Use it whenever the
+        Maestro could have changed state behind our back (reconnect, scripts, ...).
+        """
+        n = self.config['num_of_channels']
+        self.device_state = {
+            'speed': [None] * n,
+            'accel': [None] * n,
+            'target': [None] * n,
+        }
+
     def reload_default_config(self, filename=""):
         if len(filename) == 0:
             filename = self.config_file
@@ -184,19 +391,33 @@ class Controller:
 
     def close(self):
         """ Cleanup by closing USB serial port"""
+        if self.writer is not None:
+            self.writer.stop()
+            self.writer = None
         if self.tty_port_connection_established:
             self.usb.close()
     
-    def send(self, cmd):
-        """ Send a Pololu command out the serial port """ 
+    def send(self, cmd, priority=PRIORITY_NORMAL):
+        """
+        Queue a Pololu command for the serial writer thread.  Returns the number of
+        bytes queued.  Commands with PRIORITY_HIGH are written ahead of anything
+        already waiting in the normal and bulk lanes.  A queued Set Target, Set
+        Speed or Set Acceleration of the same channel is replaced by this command.
+        """
         self.last_cmd_send = cmd        
         if self.tty_port_connection_established:
-            cmd_str = self.pololu_cmd + cmd
+            if self.pololu_cmd:
+                cmd_str = self.pololu_cmd + cmd
+            else:
+                # compact protocol, command byte with the high bit set
+                cmd_str = chr(ord(cmd[0]) | 0x80) + cmd[1:]
             if PY2:
-                out = self.usb.write(cmd_str)
+                packet = cmd_str
             else:
-                out = self.usb.write(bytes(cmd_str, 'latin-1'))
-            # logger.debug("send({})".format(out))
+                packet = bytes(cmd_str, 'latin-1')
+            key = cmd[:2] if cmd[0] in SUPERSEDED_COMMANDS else None
+            self.writer.put(packet, priority, key)
+            out = len(packet)
         else:
             logger.warning("Cannot send command connection is not established")
             out = -1
@@ -211,7 +432,7 @@ class Controller:
                 while time.time() - start_time < self.timeout:
                     if self.usb.in_waiting == 1:
                         response = ord(self.usb.read())
-                        logger.debug("read() = {}".format(response))
+                        logger.debug("read() = %s", response)
             else:
                 logger.warning("Cannot use read command when the port is closed")
         else:
@@ -242,7 +463,7 @@ class Controller:
         """ Return Maximum channel range value """       
         return self.config['max'][chan]
 
-    def set_target(self, chan: object, target: object) -> object:
+    def set_target(self, chan: object, target: object, priority=PRIORITY_NORMAL, speed=None) -> object:
         """
         Set channel to a specified target value.  Servo will begin moving based
         on Speed and Acceleration parameters previously set.
@@ -251,6 +472,9 @@ class Controller:
         Servo center is at 1500 microseconds, or 6000 quarter-microseconds
         Typcially valid servo range is 3000 to 9000 quarter-microseconds
         If channel is configured for digital output, values < 6000 = Low ouput
+
+        The channel speed is brought to `speed` (configured speed by default) before
+        the target is sent.  Nothing is sent if the device already holds the values.
         """
         
         # self.target_positions[chan] = target
@@ -266,13 +490,24 @@ class Controller:
 
         self.config['target_position'][chan] = target
         target = round(target * 4)
+        if self.device_state['target'][chan] == target:
+            return
+        if speed is None:
+            speed = self.config['speed'][chan]
+        self._send_speed(chan, speed, priority)
         lsb = target & 0x7f  # 7 bits for least significant byte
         msb = (target >> 7) & 0x7f  # shift 7 and take next 7 bits for msb
         cmd = chr(0x04) + chr(chan) + chr(lsb) + chr(msb)
-        self.send(cmd)
-        # Record Target value
+        self._send_tracked('target', chan, target, cmd, priority)
 
-    def set_target_vector(self, target_vector, match_speed=1, wait=True):
+    def set_target_vector(self, target_vector, match_speed=1, wait=True, priority=PRIORITY_NORMAL):
+        """
+        Move all channels to target_vector.  With match_speed the per-channel speeds are
+        scaled so that all axis arrive at the same time.  The matched speeds are only
+        applied on the device; config['speed'] keeps the configured values and they are
+        restored by the next command that moves the channel, not eagerly after the move.
+        Returns the expected duration of the move in seconds (waited for when wait is set).
+        """
         
         initial_speed = copy.copy(self.config["speed"])
         self.config['last_speed'] = initial_speed
@@ -280,33 +515,41 @@ class Controller:
             if pos >=0 or pos <= 360:
                 pos = ang_2_pwm(pos, self.config["cal"][chan])
                 target_vector[chan] = pos # update the target vector with pwm values if vector given in degrees
-            self.set_target(chan, pos)        
         pause_sec = self.get_slowest_movement_time(target_vector)
         if match_speed:            
             new_speeds = self.match_movement_speed(target_vector)
-            self.set_speed_vector(new_speeds)
+        else:
+            new_speeds = initial_speed
+
+        for chan, pos in enumerate(target_vector):
+            self.set_target(chan, pos, priority, speed=new_speeds[chan])
 
         if wait:
-            logger.debug("set_target_vector pause time: {}".format(pause_sec))
+            logger.debug("set_target_vector pause time: %s", pause_sec)
             time.sleep(pause_sec)
-            if match_speed:
-                self.set_speed_vector(initial_speed)
 
         self.config['last_position'] = target_vector
+        return pause_sec
 
 
-    def go_home(self):
-        self.set_target_vector(self.config['home'])
+    def go_home(self, wait=True):
+        return self.set_target_vector(self.config['home'], wait=wait, priority=PRIORITY_HIGH)
+
+    def set_home(self, positions=None):
+        """ Store positions (the current positions by default) as the home position """
+        if positions is None:
+            positions = self.get_all_positions()
+        self.config['home'] = positions
 
     def run_sequency(self, sequencye, match_speed=1):
         for new_target_vector in sequencye:
             if len(new_target_vector) == 1:
-                logger.debug("run_sequence pause for {} sec".format(new_target_vector[0]))
+                logger.debug("run_sequence pause for %s sec", new_target_vector[0])
                 time.sleep(new_target_vector[0])
             else:
                 self.set_target_vector(new_target_vector, match_speed)
    
-    def set_speed(self, chan, speed):
+    def set_speed(self, chan, speed, priority=PRIORITY_NORMAL, defer=False):
         """
         This command limits the speed at which a servo channel’s output value changes. 
         The speed limit is given in units of (0.25 μs)/(10 ms), except in special cases (see Section 4.b). 
@@ -320,16 +563,37 @@ class Controller:
         than what it is physically capable of.
         At the minimum speed setting of 1, the servo output takes 40 seconds to move from 1 to 2 ms. 
         The speed setting has no effect on channels configured as inputs or digital outputs.
+
+        With defer=True only the configured speed is updated and it is sent together
+        with the next target for the channel.
         """
+        self.config['speed'][chan] = speed
+        if not defer:
+            self._send_speed(chan, speed, priority)
+
+    def _send_speed(self, chan, speed, priority=PRIORITY_NORMAL):
+        """ Send Set Speed unless the device already runs the channel at this speed """
+        if self.device_state['speed'][chan] == speed:
+            return
         lsb = speed & 0x7f  # 7 bits for least significant byte
         msb = (speed >> 7) & 0x7f  # shift 7 and take next 7 bits for msb
         cmd = chr(0x07) + chr(chan) + chr(lsb) + chr(msb)
-        self.send(cmd)
-        self.config['speed'][chan] = speed
+        self._send_tracked('speed', chan, speed, cmd, priority)
 
-    def set_speed_vector(self, speed_vector):
+    def _send_tracked(self, field, chan, value, cmd, priority=PRIORITY_NORMAL):
+        """
+        Send cmd and record value as the device-side `field` of chan.  The value is
+        recorded before the packet is queued, so if its write fails the reset done
+        by the writer thread always comes after it and the command is sent again.
+        """
+        state = self.device_state[field]
+        state[chan] = value
+        if self.send(cmd, priority) < 0:
+            state[chan] = None
+
+    def set_speed_vector(self, speed_vector, priority=PRIORITY_NORMAL):
         for chan, speed in enumerate(speed_vector):
-            self.set_speed(chan, speed)
+            self.set_speed(chan, speed, priority)
 
     def set_accel(self, chan, accel):
         """
@@ -347,7 +611,9 @@ class Controller:
         msb = (accel >> 7) & 0x7f  # shift 7 and take next 7 bits for msb
         cmd = chr(0x09) + chr(chan) + chr(lsb) + chr(msb)
         self.config['accel'][chan] = accel
-        self.send(cmd)
+        if self.device_state['accel'][chan] == accel:
+            return
+        self._send_tracked('accel', chan, accel, cmd)
 
     def get_position(self, chan):
         """
@@ -362,21 +628,67 @@ class Controller:
         response = -1
         if self.tty_port_connection_established:
             cmd = chr(0x10) + chr(chan)
-            self.send(cmd)
-            self.timeout = 1
-            start_time = time.time()
-            while time.time() - start_time < self.timeout:
-                if self.usb.in_waiting == 2:
-                    lsb = ord(self.usb.read())
-                    msb = ord(self.usb.read())
-                    return ((msb << 8) + lsb) / 4
-            if time.time() - start_time > self.timeout:
-                logger.error('Timeout during reading position')
+            with self.read_lock:
+                self.usb.reset_input_buffer()
+                self.send(cmd)
+                self.timeout = 1
+                start_time = time.time()
+                while time.time() - start_time < self.timeout:
+                    if self.usb.in_waiting == 2:
+                        lsb = ord(self.usb.read())
+                        msb = ord(self.usb.read())
+                        return ((msb << 8) + lsb) / 4
+                if time.time() - start_time > self.timeout:
+                    logger.error('Timeout during reading position')
         
         return response
 
+    def get_positions(self, channels, raw=False, priority=PRIORITY_NORMAL):
+        """
+        Pipelined Get Position for several channels.  All requests are queued at once
+        and the replies read back together, so the whole set costs one round trip.
+        Values are scaled like get_position; with raw=True the unscaled reading is
+        returned, which for channels configured as inputs is 0-1023 (0-5V, digital
+        inputs read 0 or 1023).  Returns -1 for every channel on timeout.
+        The input buffer is cleared before the requests and after a short read.
+        """
+        channels = list(channels)
+        response = [-1] * len(channels)
+        if not self.tty_port_connection_established or not channels:
+            return response
+        size = 2 * len(channels)
+        with self.read_lock:
+            # drop late replies to an earlier timed-out request, they would shift
+            # every reply of this batch
+            self.usb.reset_input_buffer()
+            for chan in channels:
+                self.send(chr(0x10) + chr(chan), priority)
+            data = self._read_exactly(size)
+            if len(data) < size:
+                self.usb.reset_input_buffer()
+        if len(data) < size:
+            logger.error('Timeout during reading positions')
+            return response
+        data = bytearray(data)
+        values = [data[ix] + (data[ix + 1] << 8) for ix in range(0, size, 2)]
+        if raw:
+            return values
+        return [v / 4 for v in values]
+
+    def _read_exactly(self, size):
+        """ Read size bytes, or whatever arrived before the timeout """
+        data = b''
+        start_time = time.time()
+        while len(data) < size and time.time() - start_time < self.timeout:
+            chunk = self.usb.read(size - len(data))
+            if chunk:
+                data += chunk
+            else:
+                time.sleep(0)
+        return data
+
     def get_all_positions(self):
-        return [self.get_position(x) for x in range(0, self.config['num_of_channels'])]
+        return self.get_positions(range(0, self.config['num_of_channels']))
     
     def is_moving(self, chan):
         """
@@ -418,13 +730,15 @@ class Controller:
         # can pass a param with command 0x28
         # cmd = chr(0x28) + chr(subNumber) + chr(lsb) + chr(msb)
         self.send(cmd)
+        # the script is free to change targets and speeds
+        self.reset_device_state()
     
     def stop_script(self):
         """
         Stop the current Maestro Script
         """
         cmd = chr(0x24)
-        self.send(cmd)
+        self.send(cmd, PRIORITY_HIGH)
 
     def get_max_pwm(self, new_vector):
         '''
@@ -432,7 +746,7 @@ class Controller:
         '''
         max_pwm = max(self.get_pwm_delta(new_vector))
         old_vector = self.config['last_position']
-        logger.debug("old: {}, new: {}, max angle: {}".format(old_vector, new_vector, max_pwm))
+        logger.debug("old: %s, new: %s, max angle: %s", old_vector, new_vector, max_pwm)
         return max_pwm
 
     def get_pwm_delta(self, new_vector):
@@ -496,11 +810,11 @@ class Controller:
         slowest_movement_at_speed =  self.config['delay_adjust'] * max(max_pwm_per_sec) / 1000.0
 
         slowest_movement_at_speed_0 = self.calculate_movement_time(self.get_max_pwm(new_vector))
-        logger.debug("slowest_movement_at_speed={}, slowest_movement_at_speed_0={}".format(slowest_movement_at_speed, slowest_movement_at_speed_0))
+        logger.debug("slowest_movement_at_speed=%s, slowest_movement_at_speed_0=%s", slowest_movement_at_speed, slowest_movement_at_speed_0)
         return max([slowest_movement_at_speed, slowest_movement_at_speed_0])
 
     def chop(self, chan, minmax, num, pause):
-        logger.debug("chop({}, {}, {}, {})".format(chan, minmax, num, pause))
+        logger.debug("chop(%s, %s, %s, %s)", chan, minmax, num, pause)
         while num:
             num = num - 1
             self.set_target(chan, minmax[0])
@@ -0,0 +1,206 @@
+"""
+Teach mode for the arm.
+
+Recorder samples the servo positions at a fixed rate into a preallocated ring
+buffer while the operator jogs the arm, then reduces the capture to a small set
+of keyframes and writes them as a .seq file that the "Run" command can play.
+"""
+
+import json
+import logging
+import math
+import os
+import threading
+import time
+
+import numpy as np
+
+logger = logging.getLogger('maestro')
+
+DEFAULT_RATE_HZ = 20
+DEFAULT_DURATION_SEC = 300
+DEFAULT_TOLERANCE = 10  # pwm, microseconds
+
+
+def check_tolerance(tolerance, channels):
+    """
+    Return tolerance if it is a positive number or a list of `channels` positive
+    numbers (one per channel), DEFAULT_TOLERANCE otherwise.
+    """
+    try:
+        tol = np.asarray(tolerance, dtype=float)
+        shape_ok = tol.ndim == 0 or (tol.ndim == 1 and tol.size == channels)
+        if shape_ok and np.all(np.isfinite(tol)) and np.all(tol > 0):
+            return tolerance
+    except (TypeError, ValueError):
+        pass
+    logger.warning("Invalid tolerance %r - using %s", tolerance, DEFAULT_TOLERANCE)
+    return DEFAULT_TOLERANCE
+
+
+def simplify(times, positions, tolerance=DEFAULT_TOLERANCE):
+    """
+    Ramer-Douglas-Peucker reduction of a multi-joint trajectory.
+
+    times is an (n,) array, positions an (n, channels) array and tolerance either a
+    single value or one value per channel (pwm microseconds).  A sample becomes a
+    keyframe when any joint deviates from the straight line (in time) between the
+    neighbouring keyframes by more than the tolerance of that joint.
+    Returns the sorted indices of the keyframes; first and last are always kept.
+    """
+    times = np.asarray(times, dtype=float)
+    positions = np.asarray(positions, dtype=float)
+    n = len(times)
+    if n < 3:
+        return np.arange(n)
+
+    tol = np.broadcast_to(np.asarray(tolerance, dtype=float), positions.shape[1:])
+    tol = np.maximum(tol, 1e-9)
+
+    keep = np.zeros(n, dtype=bool)
+    keep[0] = keep[-1] = True
+    stack = [(0, n - 1)]
+    while stack:
+        first, last = stack.pop()
+        if last - first < 2:
+            continue
+        span = times[last] - times[first]
+        if span > 0:
+            frac = (times[first + 1:last] - times[first]) / span
+        else:
+            frac = np.linspace(0, 1, last - first + 1)[1:-1]
+        line = positions[first] + frac[:, None] * (positions[last] - positions[first])
+        error = (np.abs(positions[first + 1:last] - line) / tol).max(axis=1)
+        ix = int(np.argmax(error))
+        if error[ix] > 1.0:
+            mid = first + 1 + ix
+            keep[mid] = True
+            stack.append((first, mid))
+            stack.append((mid, last))
+    return np.flatnonzero(keep)
+
+
+def keyframes_to_sequence(times, positions, speed):
+    """
+    Convert keyframes to frames in the format used by the UI and the "Run" command.
+    The speed of each frame is chosen so the channel with the largest travel covers
+    it in the recorded time; `speed` is used for the move to the first keyframe.
+    """
+    frames = []
+    for ix in range(len(times)):
+        target = [int(round(p)) for p in positions[ix]]
+        if ix > 0:
+            dt_ms = (times[ix] - times[ix - 1]) * 1000.0
+            travel = max(abs(a - b) for a, b in zip(positions[ix], positions[ix - 1]))
+            # speed is in units of 0.25us / 10ms
+            frame_speed = max(1, int(math.ceil(travel * 40.0 / dt_ms))) if dt_ms > 0 else 0
+        else:
+            frame_speed = speed
+        frames.append({
+            'frame': ix,
+            'target_pwm': target,
+            'speed': frame_speed,
+            'sleep': 0,
+            'sleep_before': 0,
+            'match_speed': True,
+        })
+    return frames
+
+
+class Recorder(object):
+    """
+    Samples get_all_positions() at rate_hz on a background thread.  Samples go
+    into a ring buffer sized for duration_sec; once it is full the oldest samples
+    are overwritten.  Only get_position requests are issued, so jog commands keep
+    flowing through the serial writer while recording.
+    """
+    def __init__(self, arm, rate_hz=DEFAULT_RATE_HZ, duration_sec=DEFAULT_DURATION_SEC):
+        self.arm = arm
+        self.rate_hz = rate_hz
+        self.capacity = int(rate_hz * duration_sec)
+        channels = arm.config['num_of_channels']
+        self.times = np.zeros(self.capacity)
+        self.positions = np.zeros((self.capacity, channels))
+        self.count = 0
+        self.running = False
+        self.thread = None
+
+    def start(self):
+        if self.running:
+            return
+        logger.info("Recorder.start(rate_hz={})".format(self.rate_hz))
+        self.count = 0
+        self.running = True
+        self.thread = threading.Thread(target=self._run, name='maestro-recorder')
+        self.thread.daemon = True
+        self.thread.start()
+
+    def stop(self):
+        self.running = False
+        if self.thread is not None:
+            self.thread.join()
+            self.thread = None
+        logger.info("Recorder.stop() - {} samples".format(min(self.count, self.capacity)))
+
+    def _run(self):
+        period = 1.0 / self.rate_hz
+        start_time = time.time()
+        next_time = start_time
+        while self.running:
+            pos = self.arm.get_all_positions()
+            if min(pos) >= 0:
+                self.add_sample(time.time() - start_time, pos)
+            next_time += period
+            delay = next_time - time.time()
+            if delay > 0:
+                time.sleep(delay)
+            else:
+                # fell behind, skip the missed ticks rather than bursting
+                next_time = time.time()
+
+    def add_sample(self, t, pos):
+        ix = self.count % self.capacity
+        self.times[ix] = t
+        self.positions[ix] = pos
+        self.count += 1
+
+    def capture(self):
+        """ Return copies of (times, positions) in chronological order """
+        if self.count <= self.capacity:
+            return self.times[:self.count].copy(), self.positions[:self.count].copy()
+        ix = self.count % self.capacity
+        order = np.r_[ix:self.capacity, 0:ix]
+        return self.times[order], self.positions[order]
+
+    def keyframes(self, tolerance=DEFAULT_TOLERANCE):
+        times, positions = self.capture()
+        if len(times) < 2:
+            raise NameError("Recorder.keyframes() - need at least 2 samples, got {}".format(len(times)))
+        ix = simplify(times, positions, check_tolerance(tolerance, positions.shape[1]))
+        logger.info("Recorder.keyframes() - {} of {} samples kept".format(len(ix), len(times)))
+        return times[ix], positions[ix]
+
+    def to_sequence(self, tolerance=DEFAULT_TOLERANCE):
+        times, positions = self.keyframes(tolerance)
+        return keyframes_to_sequence(times, positions, self.arm.config['speed'][0])
+
+    def save(self, filename, tolerance=DEFAULT_TOLERANCE):
+        """
+        Write the compressed capture as a .seq file, in the same layout as the
+        UI "Save File" command.  Returns the file content as a dictionary.
+        Raises NameError, and writes nothing, if fewer than 2 samples were captured.
+        """
+        body = self.to_sequence(tolerance)
+        filename, file_extension = os.path.splitext(filename)
+        filename = filename + ".seq"
+        seq = {
+            "id": "button",
+            "cmd": "SaveFile",
+            "filename": filename,
+            "body": body,
+        }
+        logger.info("Recorder.save({})".format(filename))
+        fid = open(filename, 'w')
+        fid.write(json.dumps(seq))
+        fid.close()
+        return seq
@@ -0,0 +1,162 @@
+"""
+Simulated Pololu Maestro.
+
+FakeMaestro behaves like the pyserial object Controller talks to: it parses the
+Pololu and compact protocol commands written to it, moves the simulated servos
+with the configured speed and answers position queries.  Pass it to the
+controller to run the app or the load test without hardware:
+
+    arm = maestro.Controller('sim', usb=simulator.FakeMaestro())
+"""
+
+import threading
+import time
+
+# command byte (compact protocol, high bit set) -> number of data bytes
+COMMAND_LENGTH = {
+    0x84: 3,  # set target
+    0x87: 3,  # set speed
+    0x89: 3,  # set acceleration
+    0x90: 1,  # get position
+    0x93: 0,  # get moving state
+    0xa1: 0,  # get errors
+    0xa2: 0,  # go home
+    0xa4: 0,  # stop script
+    0xa7: 1,  # restart script at subroutine
+    0xa8: 3,  # restart script at subroutine with parameter
+}
+
+
+class FakeMaestro(object):
+    """
+    In-memory Maestro with num_of_channels servo channels.  Channel positions
+    move towards their targets at the configured speed (0.25us / 10ms units,
+    0 = immediately).  baud > 0 adds the wire time of each write as a delay.
+    """
+    def __init__(self, num_of_channels=24, device=0x0c, baud=115200):
+        self.device = device
+        self.baud = baud
+        self.is_open = True
+        self.lock = threading.Lock()
+        self.rx = bytearray()
+        self.pending = bytearray()
+        now = time.time()
+        # quarter-microseconds
+        self.start = [6000.0] * num_of_channels
+        self.target = [6000] * num_of_channels
+        self.start_time = [now] * num_of_channels
+        self.speed = [0] * num_of_channels
+        self.accel = [0] * num_of_channels
+        # channels configured as inputs -> raw reading 0-1023
+        self.inputs = {}
+        self.commands = 0
+        self.bytes_received = 0
+
+    @property
+    def in_waiting(self):
+        return len(self.rx)
+
+    def read(self, size=1):
+        with self.lock:
+            out = bytes(self.rx[:size])
+            del self.rx[:size]
+        return out
+
+    def reset_input_buffer(self):
+        with self.lock:
+            del self.rx[:]
+
+    def write(self, data):
+        data = bytearray(data)
+        if self.baud > 0:
+            # 8N1 framing, 10 bits per byte
+            time.sleep(len(data) * 10.0 / self.baud)
+        with self.lock:
+            self.bytes_received += len(data)
+            self.pending.extend(data)
+            self._parse()
+        return len(data)
+
+    def close(self):
+        self.is_open = False
+
+    def set_input(self, chan, value):
+        """ Configure chan as an input reading value (0-1023, 0 or 1023 for digital) """
+        with self.lock:
+            self.inputs[chan] = value
+
+    def position(self, chan, now=None):
+        """ Current simulated position of chan in quarter-microseconds """
+        if now is None:
+            now = time.time()
+        distance = self.target[chan] - self.start[chan]
+        if self.speed[chan] == 0:
+            return float(self.target[chan])
+        travelled = self.speed[chan] * (now - self.start_time[chan]) * 100.0
+        if travelled >= abs(distance):
+            return float(self.target[chan])
+        return self.start[chan] + travelled * (1 if distance > 0 else -1)
+
+    def _freeze(self, chan, now):
+        self.start[chan] = self.position(chan, now)
+        self.start_time[chan] = now
+
+    def _parse(self):
+        buf = self.pending
+        while buf:
+            if buf[0] == 0xaa:
+                # Pololu protocol: 0xAA, device number, command with high bit cleared
+                if len(buf) < 3:
+                    return
+                device = buf[1]
+                cmd = buf[2] | 0x80
+                start = 3
+            else:
+                device = self.device
+                cmd = buf[0]
+                start = 1
+            length = COMMAND_LENGTH.get(cmd)
+            if length is None:
+                # out of sync, drop one byte and try again
+                del buf[:1]
+                continue
+            if len(buf) < start + length:
+                return
+            args = buf[start:start + length]
+            del buf[:start + length]
+            if device == self.device:
+                self._execute(cmd, args)
+
+    def _execute(self, cmd, args):
+        self.commands += 1
+        now = time.time()
+        if cmd in (0x84, 0x87, 0x89):
+            chan = args[0]
+            value = args[1] + (args[2] << 7)
+            if chan >= len(self.target):
+                return
+            self._freeze(chan, now)
+            if cmd == 0x84:
+                self.target[chan] = value
+            elif cmd == 0x87:
+                self.speed[chan] = value
+            else:
+                self.accel[chan] = value
+        elif cmd == 0x90:
+            chan = args[0]
+            if chan in self.inputs:
+                value = self.inputs[chan]
+            elif chan < len(self.target):
+                value = int(self.position(chan, now))
+            else:
+                value = 0
+            self.rx.extend([value & 0xff, (value >> 8) & 0xff])
+        elif cmd == 0x93:
+            moving = any(self.position(c, now) != self.target[c] for c in range(len(self.target)))
+            self.rx.append(1 if moving else 0)
+        elif cmd == 0xa1:
+            self.rx.extend([0, 0])
+        elif cmd == 0xa2:
+            for chan in range(len(self.target)):
+                self._freeze(chan, now)
+                self.target[chan] = 6000
@@ -116,6 +116,26 @@ var UI = {
         updater.socket.send(JSON.stringify(data));
     },
 
+    StartRecording: function () {
+        console.log("StartRecording")
+        var data = {
+            "id": "button",
+            "cmd": "StartRecording",
+        };
+        updater.socket.send(JSON.stringify(data));
+    },
+
+    StopRecording: function () {
+        console.log("StopRecording")
+        var data = {
+            "id": "button",
+            "cmd": "StopRecording",
+            "filename": $("#filename").val().trim(),
+            "tolerance": parseFloat($("#record_tolerance").val()),
+        };
+        updater.socket.send(JSON.stringify(data));
+    },
+
     Run: function () {
         console.log("Run :")
         var data = {
@@ -4,4 +4,10 @@ import sys
 import os
 sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
 
-import maestro
\ No newline at end of file
+import maestro
+import recorder
+import simulator
+import armd
+import logconfig
+import acquisition
+import assets
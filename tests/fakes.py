@@ -0,0 +1,70 @@
+# -*- coding: utf-8 -*-
+"""Hardware-free stand-ins used by the test suite."""
+
+import json
+import os
+
+from context import maestro, simulator
+
+
+class FakeUsb(object):
+    """Records every write() call made by the serial writer."""
+
+    def __init__(self):
+        self.writes = []
+        self.is_open = True
+        self.in_waiting = 0
+
+    def write(self, data):
+        self.writes.append(data)
+        return len(data)
+
+    def reset_input_buffer(self):
+        pass
+
+    def close(self):
+        self.is_open = False
+
+
+def write_config(tmpdir):
+    """Write DEFAULT_CONFIG to tmpdir/maestro.json and return the path."""
+    config_file = os.path.join(tmpdir, 'maestro.json')
+    with open(config_file, 'w') as fid:
+        fid.write(json.dumps(maestro.DEFAULT_CONFIG))
+    return config_file
+
+
+def make_controller(tmpdir, **kwargs):
+    """
+    Return a Controller wired to a FakeUsb as if the port had been opened.
+    The writer thread is not started; call arm.writer.flush() to drain it.
+    """
+    config_file = write_config(tmpdir)
+    arm = maestro.Controller(os.path.join(tmpdir, 'ttyACM0'), config_file=config_file, **kwargs)
+    arm.usb = FakeUsb()
+    arm.writer = arm.new_writer()
+    arm.tty_port_connection_established = True
+    return arm
+
+
+def make_sim_controller(tmpdir, **kwargs):
+    """Return a connected Controller talking to a simulator.FakeMaestro (arm.usb) without wire delay."""
+    return maestro.Controller('sim', config_file=write_config(tmpdir), usb=simulator.FakeMaestro(baud=0), **kwargs)
+
+
+def command_byte(packet):
+    """Command of a Pololu or compact protocol packet, in the Pololu (high bit cleared) form."""
+    return (packet[2] if packet[0] == 0xaa else packet[0]) & 0x7f
+
+
+def sent_packets(arm):
+    """Flush the writer and return the packets written so far, split into commands."""
+    arm.writer.flush()
+    data = b''.join(arm.usb.writes)
+    packets = []
+    while data:
+        header = 2 if data[0] == 0xaa else 0
+        size = header + (2 if data[header] & 0x7f == 0x10 else 4)
+        packets.append(data[:size])
+        data = data[size:]
+    return packets
@@ -0,0 +1,85 @@
+from context import acquisition
+from fakes import make_sim_controller
+
+import shutil
+import tempfile
+import time
+import unittest
+
+
+class TriggerTestSuite(unittest.TestCase):
+    """Threshold and edge detection."""
+
+    def feed(self, trigger, values):
+        for t, value in enumerate(values):
+            trigger.update(value, t)
+
+    def test_rising_edge_with_hysteresis(self):
+        fired = []
+        trigger = acquisition.Trigger(6, 500, lambda chan, value, t: fired.append(t), hysteresis=50)
+        self.feed(trigger, [0, 510, 490, 510, 400, 600])
+        self.assertEqual(fired, [1, 5])
+
+    def test_falling_edge(self):
+        fired = []
+        trigger = acquisition.Trigger(6, 500, lambda chan, value, t: fired.append(value), edge=acquisition.FALLING)
+        self.feed(trigger, [1023, 0, 1023, 0])
+        self.assertEqual(fired, [0, 0])
+
+
+class InputStreamTestSuite(unittest.TestCase):
+    """Sampling simulated input channels."""
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.arm = make_sim_controller(self.tmpdir)
+        self.sim = self.arm.usb
+
+    def tearDown(self):
+        self.arm.close()
+        del self.arm
+        shutil.rmtree(self.tmpdir)
+
+    def test_pipelined_read(self):
+        self.sim.set_input(7, 1023)
+        self.assertEqual(self.arm.get_positions([0, 7], raw=True), [6000, 1023])
+        self.assertEqual(self.arm.get_positions([0, 7]), [1500, 1023 / 4])
+
+    def test_stray_byte_does_not_shift_replies(self):
+        self.sim.set_input(6, 1023)
+        self.sim.set_input(7, 0)
+        # late half of a reply to a request that timed out
+        self.sim.rx.append(0x03)
+        for _ in range(2):
+            self.assertEqual(self.arm.get_positions([6, 7], raw=True), [1023, 0])
+
+    def test_ring_buffer_read_since(self):
+        stream = acquisition.InputStream(self.arm, [6, 7], capacity=4)
+        for t in range(6):
+            stream.add_sample(t, [t, 10 * t])
+        count, times, values = stream.read_since(3)
+        self.assertEqual((count, list(times)), (6, [3, 4, 5]))
+        count, times, values = stream.read_since(0)
+        self.assertEqual(list(times), [2, 3, 4, 5])
+        self.assertEqual(stream.latest(), {6: 5, 7: 50})
+
+    def test_limit_switch_fires_callback(self):
+        fired = []
+        stream = acquisition.InputStream(self.arm, [12], rate_hz=500)
+        stream.add_trigger(12, 512, lambda chan, value, t: fired.append(chan))
+        self.sim.set_input(12, 0)
+        stream.start()
+        try:
+            deadline = time.time() + 2
+            while stream.count < 5 and time.time() < deadline:
+                time.sleep(0.005)
+            self.sim.set_input(12, 1023)
+            while not fired and time.time() < deadline:
+                time.sleep(0.005)
+        finally:
+            stream.stop()
+        self.assertEqual(fired, [12])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,123 @@
+from context import armd
+from fakes import make_sim_controller
+
+import os
+import shutil
+import tempfile
+import threading
+import time
+import unittest
+
+
+class StateBlockTestSuite(unittest.TestCase):
+    """Seqlock protected shared memory state."""
+
+    def test_reader_sees_published_state(self):
+        block = armd.StateBlock.create(3)
+        reader = armd.StateBlock.attach(block.name)
+        try:
+            block.write(position=[1, 2, 3], speed=[10, 20, 30])
+            snapshot = reader.read()
+            self.assertEqual(snapshot['position'].tolist(), [1, 2, 3])
+            self.assertEqual(snapshot['speed'].tolist(), [10, 20, 30])
+            self.assertEqual(int(reader.seq[0]) % 2, 0)
+        finally:
+            reader.close()
+            block.close()
+
+    def test_read_waits_for_writer(self):
+        block = armd.StateBlock.create(1)
+        try:
+            block.seq[0] += 1
+            self.assertRaises(NameError, block.read, 10)
+        finally:
+            block.close()
+
+
+class DaemonTestSuite(unittest.TestCase):
+    """RemoteController talking to a ControllerDaemon on a simulated arm."""
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.arm = make_sim_controller(self.tmpdir)
+        self.daemon = armd.ControllerDaemon(self.arm, os.path.join(self.tmpdir, 'armd.sock'), rate_hz=200)
+        self.daemon.start()
+        self.remote = armd.RemoteController(self.daemon.socket_path)
+
+    def tearDown(self):
+        self.remote.close()
+        self.daemon.stop()
+        self.arm.close()
+        del self.remote, self.daemon, self.arm
+        shutil.rmtree(self.tmpdir)
+
+    def test_commands_reach_the_controller(self):
+        self.remote.set_speed(1, 0)
+        self.remote.set_target(1, 1200)
+        self.assertEqual(self.arm.config['target_position'][1], 1200)
+        self.assertEqual(self.remote.config['speed'][1], 0)
+
+    def test_positions_come_from_shared_memory(self):
+        self.remote.set_speed(3, 0)
+        self.remote.set_target(3, 1800)
+        deadline = time.time() + 2
+        while self.remote.get_position(3) != 1800 and time.time() < deadline:
+            time.sleep(0.01)
+        self.assertEqual(self.remote.get_all_positions()[3], 1800)
+
+    def test_unknown_method_is_rejected(self):
+        self.assertRaises(NameError, self.remote.call, 'close')
+
+    def test_clients_are_serialised(self):
+        active = []
+        overlaps = []
+        set_speed = self.arm.set_speed
+
+        def slow_set_speed(chan, speed):
+            active.append(chan)
+            overlaps.append(len(active))
+            time.sleep(0.01)
+            set_speed(chan, speed)
+            active.remove(chan)
+
+        self.arm.set_speed = slow_set_speed
+        try:
+            remotes = [armd.RemoteController(self.daemon.socket_path) for _ in range(4)]
+            threads = [threading.Thread(target=remote.set_speed, args=(chan, 100))
+                       for chan, remote in enumerate(remotes)]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+            for remote in remotes:
+                remote.close()
+        finally:
+            del self.arm.set_speed
+        self.assertEqual(len(overlaps), 4)
+        self.assertEqual(max(overlaps), 1)
+
+    def test_move_does_not_block_other_clients(self):
+        self.remote.set_target_vector([1500] * 6, 0, False)
+        self.remote.set_speed_vector([20] * 6)
+        mover = armd.RemoteController(self.daemon.socket_path)
+        # 500us at 0.5us/ms, about one second
+        thread = threading.Thread(target=mover.set_target_vector, args=([2000] * 6, 0, True))
+        thread.start()
+        try:
+            time.sleep(0.2)
+            first = self.remote.state.read()['timestamp']
+            time.sleep(0.3)
+            second = self.remote.state.read()['timestamp']
+            self.assertGreater(second, first)
+            self.assertLess(time.time() - second, 0.2)
+            start_time = time.time()
+            self.remote.go_home(wait=False)
+            self.assertLess(time.time() - start_time, 0.2)
+            self.assertTrue(thread.is_alive())
+        finally:
+            thread.join()
+            mover.close()
+
+
+if __name__ == '__main__':
+    unittest.main()
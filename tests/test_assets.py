@@ -0,0 +1,91 @@
+from context import assets
+
+import asyncio
+import gzip
+import os
+import shutil
+import tempfile
+import unittest
+
+import tornado.httpclient
+import tornado.httpserver
+import tornado.testing
+import tornado.web
+
+import app
+
+
+class PrecompressTestSuite(unittest.TestCase):
+    """Creation of the precompressed variants."""
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_only_compressible_files_get_variants(self):
+        with open(os.path.join(self.tmpdir, 'a.js'), 'w') as fid:
+            fid.write('var a = 1;\n' * 100)
+        with open(os.path.join(self.tmpdir, 'b.gif'), 'wb') as fid:
+            fid.write(b'GIF89a' * 100)
+        written = assets.precompress(self.tmpdir)
+        self.assertIn(os.path.join(self.tmpdir, 'a.js.gz'), written)
+        self.assertFalse(os.path.exists(os.path.join(self.tmpdir, 'b.gif.gz')))
+        # fresh variants are not rewritten
+        self.assertEqual(assets.precompress(self.tmpdir), [])
+
+
+class ProductionServingTestSuite(unittest.TestCase):
+    """Static files and the main page in production mode."""
+
+    @classmethod
+    def setUpClass(cls):
+        # precompress() writes next to the files, keep the variants out of the source tree
+        cls.tmpdir = tempfile.mkdtemp()
+        static_path = os.path.join(cls.tmpdir, 'static')
+        shutil.copytree(os.path.join(os.path.dirname(app.__file__), 'static'), static_path)
+        cls.application = app.Application(debug=False, static_path=static_path)
+
+    @classmethod
+    def tearDownClass(cls):
+        shutil.rmtree(cls.tmpdir)
+
+    def fetch(self, path, **kwargs):
+        async def run():
+            sock, port = tornado.testing.bind_unused_port()
+            server = tornado.httpserver.HTTPServer(self.application)
+            server.add_sockets([sock])
+            try:
+                url = "http://127.0.0.1:{}{}".format(port, path)
+                return await tornado.httpclient.AsyncHTTPClient().fetch(url, raise_error=False, **kwargs)
+            finally:
+                server.stop()
+        return asyncio.run(run())
+
+    def test_static_file_served_precompressed(self):
+        path = "/static/app.js?v=" + tornado.web.StaticFileHandler.get_version(
+            self.application.settings, "app.js")
+        response = self.fetch(path, headers={"Accept-Encoding": "gzip"}, decompress_response=False)
+        self.assertEqual(response.code, 200)
+        self.assertEqual(response.headers["Content-Encoding"], "gzip")
+        self.assertIn("javascript", response.headers["Content-Type"])
+        self.assertEqual(response.headers["Cache-Control"], assets.IMMUTABLE_CACHE_CONTROL)
+        with open(os.path.join(self.application.settings['static_path'], 'app.js'), 'rb') as fid:
+            self.assertEqual(gzip.decompress(response.body), fid.read())
+
+    def test_static_file_served_plain(self):
+        response = self.fetch("/static/app.js", decompress_response=False)
+        self.assertEqual(response.code, 200)
+        self.assertNotIn("Content-Encoding", response.headers)
+
+    def test_main_page_revalidates_with_etag(self):
+        first = self.fetch("/")
+        self.assertEqual(first.code, 200)
+        self.assertEqual(first.headers["Cache-Control"], "no-cache")
+        second = self.fetch("/", headers={"If-None-Match": first.headers["Etag"]})
+        self.assertEqual(second.code, 304)
+
+
+if __name__ == '__main__':
+    unittest.main()
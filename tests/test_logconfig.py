@@ -0,0 +1,70 @@
+from context import logconfig
+
+import logging
+import queue
+import unittest
+
+
+def make_record(level=logging.INFO, lineno=10, msg="x=%s", args=(1,)):
+    return logging.LogRecord('maestro', level, 'maestro.py', lineno, msg, args, None)
+
+
+class RateLimitFilterTestSuite(unittest.TestCase):
+    """Per call site rate limiting of log records."""
+
+    def test_burst_above_rate_is_dropped(self):
+        rate_limit = logconfig.RateLimitFilter(rate=2)
+        passed = [rate_limit.filter(make_record()) for _ in range(5)]
+        self.assertEqual(passed, [True, True, False, False, False])
+
+    def test_call_sites_are_limited_separately(self):
+        rate_limit = logconfig.RateLimitFilter(rate=1)
+        self.assertTrue(rate_limit.filter(make_record(lineno=10)))
+        self.assertTrue(rate_limit.filter(make_record(lineno=11)))
+
+    def test_warnings_are_never_dropped(self):
+        rate_limit = logconfig.RateLimitFilter(rate=1)
+        passed = [rate_limit.filter(make_record(level=logging.WARNING)) for _ in range(5)]
+        self.assertTrue(all(passed))
+
+    def test_suppressed_count_is_reported(self):
+        rate_limit = logconfig.RateLimitFilter(rate=1)
+        rate_limit.filter(make_record())
+        rate_limit.filter(make_record())
+        key = ('maestro', 'maestro.py', 10)
+        tokens, last, suppressed = rate_limit.buckets[key]
+        rate_limit.buckets[key] = (1, last, suppressed)
+        record = make_record()
+        self.assertTrue(rate_limit.filter(record))
+        self.assertEqual(record.getMessage(), "x=1 [1 similar messages suppressed]")
+
+
+class DeferredQueueHandlerTestSuite(unittest.TestCase):
+    """Only records that pass the filters are formatted, with the arguments as they were logged."""
+
+    def test_mutable_args_are_captured(self):
+        log_queue = queue.Queue()
+        handler = logconfig.DeferredQueueHandler(log_queue)
+        vector = [1, 2]
+        handler.handle(make_record(args=(vector,)))
+        vector.append(3)
+        record = log_queue.get_nowait()
+        self.assertEqual((record.msg, record.args), ("x=[1, 2]", None))
+
+    def test_filtered_record_is_not_formatted(self):
+        formatted = []
+
+        class Arg(object):
+            def __str__(self):
+                formatted.append(self)
+                return "arg"
+        log_queue = queue.Queue()
+        handler = logconfig.DeferredQueueHandler(log_queue)
+        handler.addFilter(lambda record: False)
+        handler.handle(make_record(args=(Arg(),)))
+        self.assertTrue(log_queue.empty())
+        self.assertEqual(formatted, [])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,47 @@
+from context import maestro
+from fakes import make_controller, sent_packets
+
+import shutil
+import tempfile
+import unittest
+
+
+class ProtocolTestSuite(unittest.TestCase):
+    """Pololu and compact protocol framing."""
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_single_device_uses_compact_protocol(self):
+        arm = make_controller(self.tmpdir)
+        self.assertEqual(arm.active_protocol, maestro.PROTOCOL_COMPACT)
+        arm.set_target(0, 1500, speed=0)
+        self.assertEqual(sent_packets(arm), [b'\x87\x00\x00\x00', b'\x84\x00\x70\x2e'])
+
+    def test_pololu_protocol_addresses_device(self):
+        arm = make_controller(self.tmpdir, device=0x0d, protocol=maestro.PROTOCOL_POLOLU)
+        arm.set_target(0, 1500, speed=0)
+        self.assertEqual(sent_packets(arm), [b'\xaa\x0d\x07\x00\x00\x00', b'\xaa\x0d\x04\x00\x70\x2e'])
+
+    def test_daisy_chain_selects_pololu_protocol(self):
+        arm = make_controller(self.tmpdir)
+        arm.config['daisy_chain'] = True
+        arm.select_protocol()
+        self.assertEqual(arm.active_protocol, maestro.PROTOCOL_POLOLU)
+
+    def test_non_default_device_selects_pololu_protocol(self):
+        arm = make_controller(self.tmpdir, device=0x0d)
+        self.assertEqual(arm.active_protocol, maestro.PROTOCOL_POLOLU)
+
+    def test_missing_daisy_chain_setting_selects_pololu_protocol(self):
+        arm = make_controller(self.tmpdir)
+        del arm.config['daisy_chain']
+        arm.select_protocol()
+        self.assertEqual(arm.active_protocol, maestro.PROTOCOL_POLOLU)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,70 @@
+from context import recorder
+
+import os
+import unittest
+
+import numpy as np
+
+
+class FakeArm(object):
+    config = {'num_of_channels': 2, 'speed': [100, 100]}
+
+
+class RecorderTestSuite(unittest.TestCase):
+    """Keyframe compression of recorded trajectories."""
+
+    def test_straight_move_reduces_to_end_points(self):
+        times = np.linspace(0, 2, 41)
+        positions = np.column_stack([1000 + 500 * times, 1500 - 250 * times])
+        self.assertEqual(list(recorder.simplify(times, positions, 5)), [0, 40])
+
+    def test_corner_is_kept(self):
+        times = np.arange(21) * 0.1
+        positions = np.column_stack([np.r_[np.linspace(1000, 2000, 11), np.full(10, 2000)],
+                                     np.full(21, 1500)])
+        self.assertEqual(list(recorder.simplify(times, positions, 5)), [0, 10, 20])
+
+    def test_per_joint_tolerance(self):
+        times = np.arange(3) * 0.1
+        positions = np.array([[1000, 1000], [1000, 1020], [1000, 1000]])
+        self.assertEqual(list(recorder.simplify(times, positions, [5, 50])), [0, 2])
+        self.assertEqual(list(recorder.simplify(times, positions, [50, 5])), [0, 1, 2])
+
+    def test_ring_buffer_keeps_latest_samples(self):
+        rec = recorder.Recorder(FakeArm(), rate_hz=1, duration_sec=4)
+        for t in range(6):
+            rec.add_sample(t, [t, t])
+        times, positions = rec.capture()
+        self.assertEqual(list(times), [2, 3, 4, 5])
+        self.assertEqual(list(positions[:, 0]), [2, 3, 4, 5])
+
+    def test_sequence_speed_matches_recorded_time(self):
+        frames = recorder.keyframes_to_sequence([0, 1.0], [[1000, 1000], [1500, 1100]], 100)
+        self.assertEqual(frames[0]['speed'], 100)
+        # 500us in 1000ms = 0.5us/ms = 20 * (0.25us/10ms)
+        self.assertEqual(frames[1]['speed'], 20)
+        self.assertEqual(frames[1]['target_pwm'], [1500, 1100])
+
+    def test_save_needs_two_samples(self):
+        rec = recorder.Recorder(FakeArm(), rate_hz=1, duration_sec=4)
+        rec.add_sample(0, [1000, 1000])
+        with self.assertRaises(NameError):
+            rec.save('never_written.seq')
+        self.assertFalse(os.path.exists('never_written.seq'))
+
+    def test_invalid_tolerance_falls_back_to_default(self):
+        for tolerance in (None, float('nan'), 0, -5, 'abc', [], [5, 5, 5]):
+            self.assertEqual(recorder.check_tolerance(tolerance, 2), recorder.DEFAULT_TOLERANCE)
+        self.assertEqual(recorder.check_tolerance(2.5, 2), 2.5)
+        self.assertEqual(recorder.check_tolerance([5, 50], 2), [5, 50])
+
+    def test_wrong_length_tolerance_still_saves(self):
+        rec = recorder.Recorder(FakeArm(), rate_hz=1, duration_sec=4)
+        for t in range(3):
+            rec.add_sample(t, [1000 + t, 1000])
+        times, positions = rec.keyframes([5, 5, 5])
+        self.assertEqual(list(times), [0, 2])
+
+
+if __name__ == '__main__':
+    unittest.main()
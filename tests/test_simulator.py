@@ -0,0 +1,38 @@
+from fakes import make_sim_controller
+
+import shutil
+import tempfile
+import unittest
+
+
+class SimulatorTestSuite(unittest.TestCase):
+    """Controller talking to the simulated Maestro."""
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.arm = make_sim_controller(self.tmpdir)
+        self.sim = self.arm.usb
+
+    def tearDown(self):
+        self.arm.close()
+        del self.arm
+        shutil.rmtree(self.tmpdir)
+
+    def test_connection_established(self):
+        self.assertTrue(self.arm.tty_port_connection_established)
+        self.assertEqual(self.arm.get_all_positions(), [1500] * 6)
+
+    def test_position_follows_target(self):
+        self.arm.set_speed(2, 0)
+        self.arm.set_target(2, 1200)
+        self.assertEqual(self.arm.get_position(2), 1200)
+
+    def test_speed_limits_movement(self):
+        self.arm.set_speed(0, 1)
+        self.arm.set_target(0, 2000)
+        self.arm.writer.flush()
+        self.assertLess(self.sim.position(0) / 4, 1510)
+
+
+if __name__ == '__main__':
+    unittest.main()
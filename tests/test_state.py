@@ -0,0 +1,71 @@
+from context import maestro
+from fakes import command_byte, make_controller, sent_packets
+
+import shutil
+import tempfile
+import unittest
+
+
+class DeviceStateTestSuite(unittest.TestCase):
+    """Only commands that change the device state are sent."""
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.arm = make_controller(self.tmpdir)
+
+    def tearDown(self):
+        del self.arm
+        shutil.rmtree(self.tmpdir)
+
+    def commands(self):
+        return [command_byte(p) for p in sent_packets(self.arm)]
+
+    def test_repeated_speed_is_sent_once(self):
+        self.arm.set_speed(0, 200)
+        self.arm.set_speed(0, 200)
+        self.assertEqual(self.commands(), [0x07])
+
+    def test_deferred_speed_goes_out_with_target(self):
+        self.arm.set_speed(1, 300, defer=True)
+        self.assertEqual(self.commands(), [])
+        self.arm.set_target(1, 1500)
+        self.assertEqual(self.commands(), [0x07, 0x04])
+
+    def test_unchanged_target_is_not_sent(self):
+        self.arm.set_target(2, 1500)
+        self.arm.set_target(2, 1500)
+        self.assertEqual(self.commands(), [0x07, 0x04])
+
+    def test_matched_speed_restore_is_folded_into_next_move(self):
+        self.arm.set_target_vector([1500] * 6, match_speed=0, wait=False)
+        sent = len(self.commands())
+        self.arm.set_target_vector([1600, 1700, 1500, 1500, 1500, 1500], wait=False)
+        # only the two moving channels get a speed and a target
+        self.assertEqual(self.commands()[sent:], [0x07, 0x04, 0x07, 0x04])
+        self.assertEqual(self.arm.config['speed'], maestro.DEFAULT_CONFIG['speed'])
+
+        self.arm.set_target(0, 1500)
+        # channel 0 runs at the matched speed, restore it before moving
+        self.assertEqual(self.commands()[sent + 4:], [0x07, 0x04])
+        self.assertEqual(self.arm.device_state['speed'][0], self.arm.config['speed'][0])
+
+    def test_failed_write_forgets_device_state(self):
+        usb = self.arm.usb
+        write = usb.write
+
+        def fail_once(data):
+            usb.write = write
+            raise IOError("write failed")
+        usb.write = fail_once
+        self.arm.set_speed(0, 200)
+        self.arm.set_target(1, 1700)
+        self.assertEqual(self.commands(), [])
+        self.assertEqual(self.arm.device_state['speed'][0], None)
+
+        self.arm.set_speed(0, 200)
+        self.arm.set_target(1, 1700)
+        self.assertEqual(self.commands(), [0x07, 0x07, 0x04])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,105 @@
+from context import maestro
+from fakes import FakeUsb, command_byte, make_controller, sent_packets
+
+import shutil
+import tempfile
+import threading
+import unittest
+from collections import deque
+
+
+class ProducerLane(deque):
+    """Lane that queues a packet on another lane the first time it is popped."""
+
+    def __init__(self, other, packet):
+        super(ProducerLane, self).__init__()
+        self.other = other
+        self.packet = packet
+
+    def popleft(self):
+        if self.packet is not None:
+            self.other.append((-1, None, self.packet))
+            self.packet = None
+        return super(ProducerLane, self).popleft()
+
+
+class SerialWriterTestSuite(unittest.TestCase):
+    """SerialWriter batching and priority lanes."""
+
+    def test_packets_queued_together_are_written_once(self):
+        usb = FakeUsb()
+        writer = maestro.SerialWriter(usb)
+        for chan in range(6):
+            writer.put(bytes([0x84, chan, 0x70, 0x2e]))
+        writer.start()
+        self.assertTrue(writer.flush(timeout=1))
+        writer.stop()
+        self.assertEqual(len(usb.writes), 1)
+        self.assertEqual(len(usb.writes[0]), 24)
+
+    def test_high_priority_jumps_ahead_of_bulk(self):
+        usb = FakeUsb()
+        writer = maestro.SerialWriter(usb)
+        writer.put(b'bulk', maestro.PRIORITY_BULK)
+        writer.put(b'norm', maestro.PRIORITY_NORMAL)
+        writer.put(b'stop', maestro.PRIORITY_HIGH)
+        writer.start()
+        writer.flush(timeout=1)
+        writer.stop()
+        self.assertEqual(b''.join(usb.writes), b'stopnormbulk')
+
+    def test_stop_writes_pending_packets(self):
+        usb = FakeUsb()
+        writer = maestro.SerialWriter(usb)
+        writer.start()
+        writer.put(b'\x84\x00\x70\x2e')
+        writer.stop()
+        self.assertEqual(b''.join(usb.writes), b'\x84\x00\x70\x2e')
+
+    def test_flush_waits_for_packets_put_on_a_drained_lane(self):
+        usb = FakeUsb()
+        writer = maestro.SerialWriter(usb)
+        # b'P' lands on the high lane after the writer has moved past it
+        writer.lanes[1] = ProducerLane(writer.lanes[0], b'P')
+        writer.put(b'N', maestro.PRIORITY_NORMAL)
+        marker = threading.Event()
+        writer.lanes[-1].append(marker)
+        writer._drain()
+        self.assertTrue(marker.is_set())
+        self.assertEqual(b''.join(usb.writes), b'NP')
+        self.assertFalse(any(writer.lanes))
+
+
+class SupersedeTestSuite(unittest.TestCase):
+    """Queued commands for a channel never overtake newer ones."""
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.arm = make_controller(self.tmpdir)
+
+    def tearDown(self):
+        del self.arm
+        shutil.rmtree(self.tmpdir)
+
+    def test_newer_jog_replaces_queued_bulk_target(self):
+        self.arm.set_target(0, 1000, maestro.PRIORITY_BULK)
+        self.arm.set_target(0, 1700, maestro.PRIORITY_NORMAL)
+        targets = [p for p in sent_packets(self.arm) if command_byte(p) == 0x04]
+        self.assertEqual(len(targets), 1)
+        self.assertEqual(targets[0][2] + (targets[0][3] << 7), 1700 * 4)
+        self.assertEqual(self.arm.writer.superseded, 1)
+
+    def test_other_channels_and_reads_are_kept(self):
+        self.arm.set_target(0, 1000, maestro.PRIORITY_BULK)
+        self.arm.set_target(1, 1000, maestro.PRIORITY_BULK)
+        self.arm.send(chr(0x10) + chr(0))
+        self.arm.send(chr(0x10) + chr(0))
+        self.arm.set_target(0, 1700, maestro.PRIORITY_HIGH)
+        commands = [(command_byte(p), p[1]) for p in sent_packets(self.arm)]
+        self.assertEqual(commands.count((0x04, 0)), 1)
+        self.assertEqual(commands.count((0x04, 1)), 1)
+        self.assertEqual(commands.count((0x10, 0)), 2)
+
+
+if __name__ == '__main__':
+    unittest.main()